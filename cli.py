@@ -0,0 +1,137 @@
+import argparse
+import json
+import sys
+from random import seed
+from time import perf_counter
+
+import numpy as np
+
+from utils.AsyncLogger import configure_logging
+from utils.Constants import METHOD, SEED, SETUP_TIME, TOTAL_TIME_ELAPSED, TOTAL_FWDS, FWDS_BY_SERVER, LOAD, \
+    PLAYER_COUNT, INVALID, PROFILE
+from utils.NeighborSearch import NEIGHBOR_BACKENDS, KDTREE_BACKEND
+from utils.Scenario import Scenario, SCENARIO_SEED
+from utils.Sweep import METHOD_CLASSES, DEFAULT_METHOD_OPTIONS, SCENARIO_PARAMETERS, FOCUS_METHOD, get_method_class
+
+# Lazy imports: optional and heavy packages are imported inside the functions using them, across the code base, so
+# a run only loads (and only needs installed) what its options use. The method module is imported once the arguments
+# are parsed, matplotlib only to plot a map, and the rtree and bloom filter packages only when their option is used
+
+
+def parse_option(option):
+    """Parses a NAME=VALUE method option, reading the value as JSON when it is valid JSON (numbers, booleans,
+    lists) and as a string otherwise"""
+    name, separator, value = option.partition('=')
+    if not separator or not name:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got '{option}'")
+    try:
+        return name.replace('-', '_'), json.loads(value)
+    except json.JSONDecodeError:
+        return name.replace('-', '_'), value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Allocates the players of a scenario to servers with a method and "
+                                                 "evaluates the forwards and loads")
+    parser.add_argument('method', choices=list(METHOD_CLASSES))
+    scenario = parser.add_argument_group("scenario")
+    scenario.add_argument('--player-count', type=int, default=1000)
+    scenario.add_argument('--server-count', type=int, default=4)
+    scenario.add_argument('--map-size-x', type=int, default=1000)
+    scenario.add_argument('--map-size-y', type=int, default=1000)
+    scenario.add_argument('--server-capacity', type=int, default=500)
+    scenario.add_argument('--viewable-players', type=int, default=50)
+    scenario.add_argument('--visibility-radius', type=float, default=None,
+                          help="players see every player within this radius instead of their viewable players nearest")
+    scenario.add_argument('--forward-weight', type=float, default=0.4)
+    scenario.add_argument('--seed', type=int, default=None, help="numpy and random seed of the run")
+    scenario.add_argument('--fixed-seeds', action='store_true', help="the fixed seeds of the methods")
+    scenario.add_argument('--scenario-cache-dir', default=None,
+                          help="loads the players and neighbors from this scenario cache, building them when missing")
+    method = parser.add_argument_group("method")
+    method.add_argument('--neighbor-backend', choices=list(NEIGHBOR_BACKENDS), default=KDTREE_BACKEND)
+    method.add_argument('--approximate-interest-groups', action='store_true')
+    method.add_argument('--number-of-tries', type=int, default=None,
+                        help=f"focus tries (default {DEFAULT_METHOD_OPTIONS[FOCUS_METHOD]['number_of_tries']})")
+    method.add_argument('--option', type=parse_option, action='append', default=[], metavar='NAME=VALUE',
+                        help="any other method argument, repeatable (e.g. --option number_of_workers=4)")
+    output = parser.add_argument_group("output")
+    output.add_argument('--verbose', action='store_true')
+    output.add_argument('--log-file', default=None, help="writes the method output to a file instead of stdout")
+    output.add_argument('--player-sample-rate', type=float, default=1.0, help="share of the per-player events logged")
+    output.add_argument('--json', action='store_true', help="prints the results as JSON on stdout")
+    output.add_argument('--output', default=None, help="writes the JSON results to a file")
+    output.add_argument('--no-plot', action='store_true', help="skips the map plot")
+    output.add_argument('--show-plot', action='store_true', help="shows the map instead of only saving it")
+    output.add_argument('--profile-report', default=None, help="writes the profiling report as JSON to this file")
+    output.add_argument('--cprofile', action='store_true', help="adds a cProfile summary to the profiling report")
+    output.add_argument('--trace-memory', action='store_true', help="adds tracemalloc peaks to the profiling report")
+    return parser
+
+
+def run(args):
+    """Builds and runs the method of the parsed arguments, returning its results"""
+    start = perf_counter()
+    # JSON on stdout is only kept clean when the method output goes elsewhere
+    logger = configure_logging(args.log_file, args.player_sample_rate,
+                               enabled=args.log_file is not None or not args.json)
+    options = {**DEFAULT_METHOD_OPTIONS.get(args.method, {}), **dict(args.option)}
+    if args.method == FOCUS_METHOD and args.number_of_tries is not None:
+        options['number_of_tries'] = args.number_of_tries
+    if args.seed is not None:
+        seed(args.seed)
+        np.random.seed(args.seed)
+    if args.scenario_cache_dir is not None:
+        options['scenario'] = Scenario.load_or_build(args.player_count, args.map_size_x, args.map_size_y,
+                                                     args.viewable_players,
+                                                     SCENARIO_SEED if args.seed is None else args.seed,
+                                                     args.scenario_cache_dir)
+        np.random.set_state(options['scenario'].random_state)
+    method = get_method_class(args.method)(**{name: getattr(args, name) for name in SCENARIO_PARAMETERS},
+                                           verbose=args.verbose, fixed_seeds=args.fixed_seeds,
+                                           neighbor_backend=args.neighbor_backend,
+                                           approximate_interest_groups=args.approximate_interest_groups,
+                                           visibility_radius=args.visibility_radius, **options)
+    method.enable_profiling(args.cprofile, args.trace_memory)
+    setup_time = perf_counter() - start
+    method.allocate_players()
+    evaluation = method.evaluate_allocation()
+    if not args.no_plot:
+        if not args.show_plot:
+            import matplotlib
+            matplotlib.use('Agg')
+        method.plot_map(save_file=True, show_plot=args.show_plot)
+    if args.profile_report is not None:
+        method.write_profile_report(args.profile_report)
+    logger.close()
+    return {
+        METHOD: args.method,
+        **{name: getattr(args, name) for name in SCENARIO_PARAMETERS},
+        'visibility_radius': args.visibility_radius,
+        SEED: args.seed,
+        SETUP_TIME: setup_time,
+        TOTAL_TIME_ELAPSED: method.data_output[TOTAL_TIME_ELAPSED],
+        TOTAL_FWDS: evaluation[TOTAL_FWDS],
+        INVALID: evaluation[INVALID],
+        'servers': {name: evaluation[name] for name in (FWDS_BY_SERVER, LOAD, PLAYER_COUNT)},
+        PROFILE: {name: phase['seconds'] for name, phase in method.data_output[PROFILE]['phases'].items()}
+    }
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.number_of_tries is not None and any(name == 'number_of_tries' for name, _ in args.option):
+        parser.error("give the focus tries either with --number-of-tries or with --option number_of_tries")
+    results = run(args)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.json:
+        json.dump(results, sys.stdout)
+        sys.stdout.write("\n")
+    return results
+
+
+if __name__ == '__main__':
+    main()
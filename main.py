@@ -1,5 +1,3 @@
-import sys
-
 import seaborn as sns
 
 from methods.Focus import Focus
@@ -7,11 +5,16 @@ from methods.Grid import Grid
 from methods.Hashing import Hashing
 from methods.Partition import Partition
 from utils import GraphUtils
+from utils.AsyncLogger import configure_logging
+from utils.DeferredPlots import DeferredPlots
 from utils.OutputUtils import get_log_output_path
+from utils.Scenario import Scenario
 
 sns.set()
 
-sys.stdout = open(get_log_output_path(), 'w')
+logger = configure_logging(get_log_output_path())
+# maps are rendered after the methods ran, on a background process
+plots = DeferredPlots()
 
 player_count = 1000
 server_count = 4
@@ -22,35 +25,42 @@ viewable_players = 50
 forward_weight = 0.4
 number_of_tries = 10
 
+# players and neighbors are generated once and shared by every method
+scenario = Scenario(player_count, map_size_x, map_size_y, viewable_players)
+
 hashing_method = Hashing(player_count=player_count, server_count=server_count, map_size_x=map_size_x,
                          map_size_y=map_size_y,
                          server_capacity=server_capacity,
                          viewable_players=viewable_players, forward_weight=forward_weight, verbose=True,
-                         fixed_seeds=True)
+                         fixed_seeds=True, scenario=scenario)
 hashing_method.allocate_players()
-hashing_method.plot_map(save_file=False, show_plot=False)
+plots.add(hashing_method)
 
 partition_method = Partition(player_count=player_count, server_count=server_count, map_size_x=map_size_x,
                              map_size_y=map_size_y,
                              server_capacity=server_capacity,
-                             viewable_players=viewable_players, forward_weight=forward_weight, verbose=True, fixed_seeds=True)
+                             viewable_players=viewable_players, forward_weight=forward_weight, verbose=True, fixed_seeds=True,
+                             scenario=scenario)
 partition_method.allocate_players()
-partition_method.plot_map(save_file=False, show_plot=False)
+plots.add(partition_method)
 
 
 grid_method = Grid(player_count=player_count, server_count=server_count, map_size_x=map_size_x, map_size_y=map_size_y,
                    server_capacity=server_capacity,
-                   viewable_players=viewable_players, forward_weight=forward_weight, verbose=True, fixed_seeds=True)
+                   viewable_players=viewable_players, forward_weight=forward_weight, verbose=True, fixed_seeds=True,
+                   scenario=scenario)
 grid_method.allocate_players()
-grid_method.plot_map(save_file=False, show_plot=False)
+plots.add(grid_method)
 
 focus_method = Focus(player_count=player_count, server_count=server_count, map_size_x=map_size_x, map_size_y=map_size_y,
                      server_capacity=server_capacity,
                      viewable_players=viewable_players, forward_weight=forward_weight, number_of_tries=number_of_tries,
-                     verbose=True, fixed_seeds=True)
+                     verbose=True, fixed_seeds=True, scenario=scenario)
 focus_method.allocate_players()
-focus_method.plot_map(save_file=False, show_plot=False)
+plots.add(focus_method)
+plots.render()
 GraphUtils.plot_methods_time(hashing_method, partition_method, grid_method, focus_method)
+plots.wait()
 
-sys.stdout.close()
+logger.close()
 
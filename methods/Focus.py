@@ -1,80 +1,279 @@
-from copy import deepcopy
-from random import choice, uniform
-from time import time
+from concurrent.futures import ProcessPoolExecutor
+from random import choice
+from time import perf_counter
 
-from rtree import index
+import numpy as np
 
 from methods.Method import Method
-from utils.Constants import POS_X, POS_Y, SERVER, PLAYER_COUNT, POSITION, ID, INVALID, TIME_ELAPSED, TOTAL_FWDS, \
-    FWDS_BY_SERVER, TRIES, MIN_FWD, TOTAL_TIME_ELAPSED, PLAYER_LIST, SERVER_LIST
-from utils.ServerUtils import find_k_nearest_servers, clear_allocations
-from utils.SpatialIndex import add_to_spatial_index
+from utils.AsyncLogger import get_logger
+from utils.Constants import POS_X, POS_Y, INVALID, TIME_ELAPSED, TOTAL_FWDS, \
+    FWDS_BY_SERVER, TRIES, MIN_FWD, TOTAL_TIME_ELAPSED, PLAYER_LIST, SERVER_LIST, \
+    SPILL_RATIO, REFINEMENT_FWDS, REFINEMENT_TIMES, LOAD, MAX_SERVER_LOAD
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.PlayerStore import PlayerStore
+from utils.ServerAssignment import assign_to_nearest_server
+from utils.ServerUtils import clear_allocations, evaluate_allocation, count_forwards
+from utils.SharedArrays import share_array, attach_array, share_neighbors, attach_neighbors, release_shared_memory
+
+CAPACITY_ROUNDS = 40  # weight adjustments a capacity-aware try makes to fit every server under the load limit
+INITIAL_WEIGHT_STEP = 0.05  # first weight step, as a share of the mean squared distance of the players per server
+
+worker_shared_memories = []
+worker_players = None
+
+
+def assign_within_load_limit(players, server_positions, load_factor_own_cost, load_factor_forward_cost, max_load,
+                              server_weights=None, rounds=CAPACITY_ROUNDS):
+    """Allocates the players to weighted server foci (see assign_to_nearest_server), adjusting the weights until no
+    server is loaded above max_load, its players plus its forwards. Every round moves each server's weight by its own
+    step towards the mean load, growing the step while its direction holds and halving it when it flips, so loaded
+    cells shrink into their neighbors while staying convex. Stops at the first viable allocation and otherwise keeps
+    the one with the lowest maximum load, returning its weights"""
+    server_count = len(server_positions)
+    positions = players.positions
+    weights = np.zeros(server_count) if server_weights is None else np.array(server_weights, dtype=np.float64)
+    spread = ((positions - positions.mean(axis=0)) ** 2).sum(axis=1).mean() / max(server_count, 1)
+    steps = np.full(server_count, INITIAL_WEIGHT_STEP * spread)
+    directions = np.zeros(server_count)
+    best_max_load, best_servers, best_weights = np.inf, None, None
+    for _ in range(rounds):
+        players.server[:], player_counts = assign_to_nearest_server(positions, server_positions, weights)
+        loads = player_counts * load_factor_own_cost + \
+            count_forwards(players, server_count) * load_factor_forward_cost
+        if loads.max() < best_max_load:
+            best_max_load, best_servers, best_weights = loads.max(), players.server.copy(), weights.copy()
+        if best_max_load <= max_load:
+            break
+        new_directions = np.sign(loads - loads.mean())
+        steps = np.where(new_directions * directions > 0, steps * 1.5,
+                         np.where(new_directions * directions < 0, steps * 0.5, steps))
+        weights += new_directions * steps
+        directions = new_directions
+    players.server[:] = best_servers
+    return best_weights
+
+
+def assign_to_nearest_focus(players, server_positions, load_factor_own_cost, load_factor_forward_cost, max_load=None):
+    """Allocates every player to the server with the nearest focus, returning the share of players allocated away
+    from their nearest server (only when a load limit is given, see assign_within_load_limit)"""
+    players.server[:], _ = assign_to_nearest_server(players.positions, server_positions)
+    if max_load is None:
+        return 0.0
+    nearest_servers = players.server.copy()
+    assign_within_load_limit(players, server_positions, load_factor_own_cost, load_factor_forward_cost, max_load)
+    return float(np.count_nonzero(players.server != nearest_servers)) / max(len(players), 1)
+
+
+def run_focus_try(players, server_positions, load_factor_own_cost, load_factor_forward_cost, approximate=False,
+                  max_load=None):
+    """Runs a single focus try, returning its evaluation, the time spent allocating players and the spill ratio"""
+    try_start_time = perf_counter()
+    spill_ratio = assign_to_nearest_focus(players, server_positions, load_factor_own_cost, load_factor_forward_cost,
+                                          max_load)
+    end_try_time = perf_counter()
+    evaluation = evaluate_allocation(players, len(server_positions), load_factor_own_cost, load_factor_forward_cost,
+                                     approximate)
+    return evaluation, end_try_time - try_start_time, spill_ratio
+
+
+def init_focus_worker(positions_descriptor, neighbors_descriptor):
+    """Attaches a pool worker to the shared player positions and neighbors"""
+    global worker_players
+    positions_memory, positions = attach_array(positions_descriptor)
+    neighbors_memories, neighbors = attach_neighbors(neighbors_descriptor)
+    worker_shared_memories.extend([positions_memory, *neighbors_memories])
+    worker_players = PlayerStore(positions, neighbors=neighbors)
+
+
+def run_shared_focus_try(focus_try):
+    """Runs a focus try on the worker's shared players"""
+    return run_focus_try(worker_players, *focus_try)
 
 
 class Focus(Method):
     def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
-                 forward_weight, number_of_tries, verbose=False, fixed_seeds=False):
+                 forward_weight, number_of_tries, verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, number_of_workers=1,
+                 capacity_aware=False, capacity_fill=1.0, refinement_iterations=0, refinement_tolerance=0.01,
+                 refinement_patience=3, capacity_penalty=0.5, scenario=None,
+                 visibility_radius=None):
         super().__init__(player_count, server_count, map_size_x,
                          map_size_y, server_capacity, viewable_players,
-                         forward_weight, verbose, fixed_seeds)
-        self.servers_index = index.Index()
+                         forward_weight, verbose, fixed_seeds, neighbor_backend,
+                         approximate_interest_groups, scenario=scenario,
+                         visibility_radius=visibility_radius)
         self.possible_focus_positions = self.get_possible_focus_positions()
         self.method_name = "Focus Method"
         self.number_of_tries = number_of_tries
+        self.number_of_workers = number_of_workers
+        self.capacity_aware = capacity_aware
+        # load, players plus forwards, a server is balanced under; a fill below 1.0 leaves headroom
+        self.max_load = MAX_SERVER_LOAD * capacity_fill if self.capacity_aware else None
+        self.refinement_iterations = refinement_iterations
+        self.refinement_tolerance = refinement_tolerance
+        self.refinement_patience = refinement_patience
+        self.capacity_penalty = capacity_penalty
 
     def allocate_players(self):
+        self.start_timer()
         super().allocate_players()
         number_of_focus_possibilities = len(self.possible_focus_positions)
-        try_count = 0
+        # focus positions are drawn up front so the tries do not depend on the number of workers
+        tries_server_positions = [
+            self.possible_focus_positions[[choice(range(number_of_focus_possibilities)) for _ in self.server_list]]
+            for _ in range(self.number_of_tries)
+        ]
+        if self.number_of_workers > 1:
+            try_results = self.run_tries_in_parallel(tries_server_positions)
+            tries_players = [None] * self.number_of_tries
+        else:
+            try_results, tries_players = [], []
+            for server_positions in tries_server_positions:
+                try_results.append(self.run_try(server_positions))
+                tries_players.append(self.players.server.copy())
         self.data_output[TRIES] = []
-        while try_count < self.number_of_tries:
-            for s in self.server_list:
-                idx = choice(range(number_of_focus_possibilities))
-                position = self.possible_focus_positions[idx]
-                s[POS_X] = position[POSITION][0]
-                s[POS_Y] = position[POSITION][1]
-            try_start_time = time()
-            for server_id, server in enumerate(self.server_list):
-                add_to_spatial_index(self.servers_index, server_id, server[POS_X], server[POS_Y])
-            for player in self.players_list:
-                chosen_server_idx = find_k_nearest_servers(self.servers_index, player[POS_X], player[POS_Y], 1)[0]
-                if chosen_server_idx is None:
-                    self.server_list[player[SERVER]][PLAYER_COUNT] -= 1
-                    del player[SERVER]
-                else:
-                    chosen_server = self.server_list[chosen_server_idx]
-                    player[SERVER] = chosen_server_idx
-                    self.server_list[chosen_server_idx][PLAYER_COUNT] += 1
-                    if self.verbose:
-                        server_pos_x = self.server_list[chosen_server_idx][POS_X]
-                        server_pos_y = self.server_list[chosen_server_idx][POS_Y]
-                        print(f"Player {player[ID]} allocated in server {chosen_server[ID]} - Server coordinates: ({server_pos_x},{server_pos_y}) - Player coordinates: ({player[POS_X]},{player[POS_Y]})")
-            end_try_time = time()
-            total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(self.players_list, self.interest_groups)
+        for server_positions, (evaluation, try_time_elapsed, spill_ratio), try_players in zip(
+                tries_server_positions, try_results, tries_players):
+            self.print_evaluation(evaluation, verbose=self.verbose)
             try_data = {
-                INVALID: invalid_distribution,
-                TIME_ELAPSED: end_try_time - try_start_time,
-                TOTAL_FWDS: total_forwards,
-                FWDS_BY_SERVER: forwards_by_server,
-                PLAYER_LIST: deepcopy(self.players_list),
-                SERVER_LIST: deepcopy(self.server_list)
+                INVALID: evaluation[INVALID],
+                TIME_ELAPSED: try_time_elapsed,
+                TOTAL_FWDS: evaluation[TOTAL_FWDS],
+                FWDS_BY_SERVER: evaluation[FWDS_BY_SERVER],
+                PLAYER_LIST: try_players,
+                SERVER_LIST: server_positions,
+                SPILL_RATIO: spill_ratio
             }
             self.data_output[TRIES].append(try_data)
-            try_count += 1
-            clear_allocations(self.players_list, self.server_list)
         self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
         self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
-        best_try = [x for x in self.data_output[TRIES] if x[TOTAL_FWDS] == self.data_output[MIN_FWD]][0]
-        self.players_list = best_try[PLAYER_LIST]
-        self.server_list = best_try[SERVER_LIST]
-        return self.server_list, self.players_list
+        best_try_idx = [data[TOTAL_FWDS] for data in self.data_output[TRIES]].index(self.data_output[MIN_FWD])
+        best_try = self.data_output[TRIES][best_try_idx]
+        best_evaluation = self.restore_try(best_try)
+        self.data_output[SPILL_RATIO] = best_try[SPILL_RATIO]
+        if self.refinement_iterations > 0:
+            self.refine_best_try(best_try[SERVER_LIST], best_evaluation)
+        self.stop_timer()
+        return self.server_list, self.players
+
+    def refine_best_try(self, server_positions, best_evaluation):
+        """Refines the best random try and keeps the refined layout when it is better (viable first, then forwards)"""
+        refined_positions, refined_weights, forwards_history, times_history = \
+            self.refine_focus_positions(server_positions)
+        self.data_output[REFINEMENT_FWDS] = forwards_history
+        self.data_output[REFINEMENT_TIMES] = times_history
+        self.data_output[TOTAL_TIME_ELAPSED] += times_history[-1]
+        self.assign_refined_positions(refined_positions, refined_weights)
+        refined_evaluation = self.evaluate_allocation()
+        if (refined_evaluation[INVALID], refined_evaluation[TOTAL_FWDS]) < \
+                (best_evaluation[INVALID], best_evaluation[TOTAL_FWDS]):
+            self.data_output[MIN_FWD] = refined_evaluation[TOTAL_FWDS]
+            self.print_evaluation(refined_evaluation, verbose=self.verbose)
+        else:
+            self.assign_refined_positions(server_positions, np.zeros(len(server_positions)))
+            self.evaluate_allocation()
+
+    def assign_refined_positions(self, server_positions, server_weights):
+        """Allocates the players to weighted server foci, returning the number of players in each server and the
+        weights used. Capacity-aware allocations start from the given weights and balance them under the load limit"""
+        for server, (x, y) in zip(self.server_list, server_positions.tolist()):
+            server[POS_X] = x
+            server[POS_Y] = y
+        if self.max_load is None:
+            self.players.server[:], player_counts = assign_to_nearest_server(self.players.positions, server_positions,
+                                                                             server_weights)
+            return player_counts, server_weights
+        server_weights = assign_within_load_limit(self.players, server_positions, self.load_factor_own_cost,
+                                                  self.load_factor_forward_cost, self.max_load, server_weights)
+        return self.players.player_counts(len(server_positions)), server_weights
+
+    def refine_focus_positions(self, server_positions):
+        """Moves the server foci Lloyd/k-means style: every iteration allocates the players, moves each focus to the
+        centroid of its players and raises the weight of servers loaded above the mean, shrinking their cells.
+        Capacity-aware allocations balance these weights under the load limit and the next iteration goes on from the
+        balanced ones. Stops once the best layout improves less than the tolerance for refinement_patience iterations.
+        Returns the best positions and weights with the forwards and elapsed time of every iteration"""
+        server_count = len(server_positions)
+        server_positions = server_positions.copy()
+        server_weights = np.zeros(server_count)
+        best_positions, best_weights, best_key = server_positions.copy(), server_weights.copy(), None
+        forwards_history, times_history = [], []
+        stalled_iterations = 0
+        start_time = perf_counter()
+        for _ in range(self.refinement_iterations):
+            player_counts, server_weights = self.assign_refined_positions(server_positions, server_weights)
+            evaluation = evaluate_allocation(self.players, server_count, self.load_factor_own_cost,
+                                             self.load_factor_forward_cost, self.approximate_interest_groups)
+            forwards_history.append(evaluation[TOTAL_FWDS])
+            times_history.append(perf_counter() - start_time)
+            key = (evaluation[INVALID], evaluation[TOTAL_FWDS])
+            if best_key is not None and (key[0] > best_key[0] or (
+                    key[0] == best_key[0] and key[1] > best_key[1] * (1 - self.refinement_tolerance))):
+                stalled_iterations += 1
+            else:
+                stalled_iterations = 0
+            if best_key is None or key < best_key:
+                best_positions, best_weights, best_key = server_positions.copy(), server_weights.copy(), key
+            if stalled_iterations >= self.refinement_patience:
+                break
+            occupied = player_counts > 0
+            for axis in range(2):
+                centroids = np.bincount(self.players.server, weights=self.players.positions[:, axis],
+                                        minlength=server_count)
+                server_positions[occupied, axis] = centroids[occupied] / player_counts[occupied]
+            spread = ((self.players.positions - server_positions[self.players.server]) ** 2).sum(axis=1).mean()
+            loads = np.array(evaluation[LOAD])
+            server_weights += self.capacity_penalty * spread * (loads - loads.mean()) / max(loads.mean(), 1e-9)
+        return best_positions, best_weights, forwards_history, times_history
+
+    def restore_try(self, try_data):
+        """Rebuilds the players allocation and servers of a try, replaying it when only its server positions were kept"""
+        if try_data[PLAYER_LIST] is None:
+            clear_allocations(self.players, self.server_list)
+            assign_to_nearest_focus(self.players, try_data[SERVER_LIST], self.load_factor_own_cost,
+                                    self.load_factor_forward_cost, self.max_load)
+            try_data[PLAYER_LIST] = self.players.server.copy()
+        return super().restore_try(try_data)
+
+    def run_try(self, server_positions):
+        """Runs a single try on this process' players"""
+        clear_allocations(self.players, self.server_list)
+        evaluation, try_time_elapsed, spill_ratio = run_focus_try(self.players, server_positions,
+                                                                  self.load_factor_own_cost,
+                                                                  self.load_factor_forward_cost,
+                                                                  self.approximate_interest_groups,
+                                                                  self.max_load)
+        if self.verbose:
+            server_positions = np.asarray(server_positions)
+            get_logger().player_events(
+                "Player {player} allocated in server {server} - Server coordinates: ({server_x},{server_y}) - "
+                "Player coordinates: ({x},{y})", player=self.players.ids, server=self.players.server,
+                server_x=server_positions[self.players.server, 0], server_y=server_positions[self.players.server, 1],
+                x=self.players.pos_x, y=self.players.pos_y)
+        return evaluation, try_time_elapsed, spill_ratio
+
+    def run_tries_in_parallel(self, tries_server_positions):
+        """Runs the tries on a process pool sharing the player positions and neighbors,
+        only the evaluations come back from the workers"""
+        positions_memory, positions_descriptor = share_array(self.players.positions)
+        neighbors_memories, neighbors_descriptor = share_neighbors(self.players.neighbors)
+        focus_tries = [(server_positions, self.load_factor_own_cost, self.load_factor_forward_cost,
+                        self.approximate_interest_groups, self.max_load)
+                       for server_positions in tries_server_positions]
+        try:
+            with ProcessPoolExecutor(max_workers=self.number_of_workers, initializer=init_focus_worker,
+                                     initargs=(positions_descriptor, neighbors_descriptor)) as executor:
+                chunk_size = max(1, len(focus_tries) // (self.number_of_workers * 4))
+                return list(executor.map(run_shared_focus_try, focus_tries, chunksize=chunk_size))
+        finally:
+            release_shared_memory(positions_memory, *neighbors_memories)
 
     def plot_map(self, save_file=True, show_plot=True):
         cmap, plt, full_path = super().plot_map()
         for server_idx, server in enumerate(self.server_list):
             plt.scatter(server[POS_X], server[POS_Y], c="red", marker="s", s=100,
                         label=f"Server {server_idx}")
-            plt.annotate(xy=(server[POS_X], server[POS_Y]), s=f"Server {server_idx}")
+            plt.annotate(f"Server {server_idx}", xy=(server[POS_X], server[POS_Y]))
         if save_file:
             plt.savefig(full_path)
         if show_plot:
@@ -82,8 +281,5 @@ class Focus(Method):
 
     def get_possible_focus_positions(self):
         """Returns all possible server focus positions"""
-        return [{POSITION: (max(min(player[POS_X] + uniform(5, 10), self.map_size_x), 0),
-                            max(min(player[POS_Y] + uniform(5, 10), self.map_size_y), 0)
-                           )
-                 }
-                for player in self.players_list]
+        jitter = np.random.uniform(5, 10, self.players.positions.shape)
+        return np.clip(self.players.positions + jitter, 0, (self.map_size_x, self.map_size_y))
@@ -0,0 +1,66 @@
+import numpy as np
+
+from methods.Method import Method
+from utils.Constants import TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, FWDS_BY_SERVER, PLAYER_LIST, SERVER_LIST, \
+    MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.GraphPartitioning import build_visibility_graph, multilevel_partition, refine_forwards
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.ServerUtils import update_player_counts
+
+
+class GraphPartition(Method):
+    def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                 forward_weight,
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, imbalance=0.03,
+                 refinement_passes=10, coarsest_size_per_server=30, forward_refinement_passes=10, scenario=None,
+                 visibility_radius=None):
+        super().__init__(player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                         forward_weight, verbose, fixed_seeds, neighbor_backend, approximate_interest_groups,
+                         scenario=scenario,
+                         visibility_radius=visibility_radius)
+        self.method_name = "Graph Partition Method"
+        self.imbalance = imbalance
+        self.refinement_passes = refinement_passes
+        self.coarsest_size_per_server = coarsest_size_per_server
+        self.forward_refinement_passes = forward_refinement_passes
+
+    def allocate_players(self):
+        self.start_timer()
+        super().allocate_players()
+        number_of_servers = len(self.server_list)
+        balanced_players = int(np.ceil(len(self.players) / number_of_servers))
+        # the capacity only tightens the balance constraint while it can still hold every player
+        max_players = max(min(int(np.ceil(balanced_players * (1 + self.imbalance))), self.server_capacity),
+                          balanced_players)
+        adjacency = build_visibility_graph(self.players.neighbors, len(self.players))
+        rng = np.random.default_rng(np.random.randint(2 ** 31))
+        parts = multilevel_partition(adjacency, self.players.positions, number_of_servers, max_players, rng,
+                                     self.coarsest_size_per_server * number_of_servers, self.refinement_passes)
+        # the edge cut only approximates the forwards, the finest level is refined for the forwards themselves
+        self.players.server[:] = refine_forwards(self.players.neighbors, parts, number_of_servers, max_players,
+                                                 self.forward_refinement_passes, rng)
+        update_player_counts(self.players, self.server_list)
+        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(verbose=self.verbose)
+        self.stop_timer()
+        self.data_output[TRIES] = [{
+            INVALID: invalid_distribution,
+            TIME_ELAPSED: self.time_elapsed,
+            TOTAL_FWDS: total_forwards,
+            FWDS_BY_SERVER: forwards_by_server,
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
+        }]
+        self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
+        self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
+        return self.server_list
+
+    def plot_map(self, save_file=True, show_plot=True):
+        cmap, plt, full_path = super().plot_map()
+        for server_idx, server in enumerate(self.server_list):
+            plt.scatter(-50, -50, color=cmap(server_idx), marker="s", s=100, label=f"Server {server_idx}")
+        plt.legend()
+        if save_file:
+            plt.savefig(full_path)
+        if show_plot:
+            plt.show()
@@ -1,51 +1,59 @@
-from copy import deepcopy
-
 import numpy as np
 
 from methods.Method import Method
-from utils.Constants import PLAYER_COUNT, SERVER, POS_X, POS_Y, X_MIN, Y_MIN, Y_MAX, X_MAX, TRIES, INVALID, \
+from utils.Constants import SERVER, X_MIN, Y_MIN, Y_MAX, X_MAX, TRIES, INVALID, \
     TIME_ELAPSED, TOTAL_FWDS, FWDS_BY_SERVER, PLAYER_LIST, SERVER_LIST, MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.ServerUtils import update_player_counts
 
 
 class Grid(Method):
     def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
                  forward_weight,
-                 verbose=False, fixed_seeds=False):
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, scenario=None,
+                 visibility_radius=None):
         super().__init__(player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
-                         forward_weight, verbose, fixed_seeds)
+                         forward_weight, verbose, fixed_seeds, neighbor_backend,
+                         approximate_interest_groups, scenario=scenario,
+                         visibility_radius=visibility_radius)
         self.method_name = "Grid Method"
         self.frontiers = []
+        self.cell_servers = None
 
     def allocate_players(self):
         self.start_timer()
         super().allocate_players()
         number_of_servers = len(self.server_list)
         grid_dimension = int(np.ceil(np.sqrt(number_of_servers)))
-        for i in range(grid_dimension):
-            for j in range(grid_dimension):
-                self.frontiers.append(
-                    {X_MIN: j * (self.map_size_x / grid_dimension), X_MAX: (j + 1) * (self.map_size_x / grid_dimension),
-                     Y_MIN: i * (self.map_size_y / grid_dimension), Y_MAX: (i + 1) * (self.map_size_y / grid_dimension),
-                     SERVER: len(self.frontiers) if len(self.frontiers) < number_of_servers - 1 else number_of_servers - 1})
-        for player in self.players_list:
-            for cell in self.frontiers:
-                if cell[X_MIN] <= player[POS_X] <= cell[X_MAX] and cell[Y_MIN] <= player[POS_Y] <= cell[Y_MAX]:
-                    player[SERVER] = cell[SERVER]
-                    self.server_list[player[SERVER]][PLAYER_COUNT] += 1
-                    break
-        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(self.players_list, self.interest_groups)
+        cell_width = self.map_size_x / grid_dimension
+        cell_height = self.map_size_y / grid_dimension
+        # cells are numbered row by row, the leftover cells all go to the last server
+        self.cell_servers = np.minimum(np.arange(grid_dimension ** 2), number_of_servers - 1).astype(np.int32)
+        self.frontiers = [
+            {X_MIN: j * cell_width, X_MAX: (j + 1) * cell_width,
+             Y_MIN: i * cell_height, Y_MAX: (i + 1) * cell_height,
+             SERVER: int(self.cell_servers[i * grid_dimension + j])}
+            for i in range(grid_dimension) for j in range(grid_dimension)
+        ]
+        # half-open cells [min, max), players on the far map border belong to the last row/column
+        cell_column = np.clip(np.floor(self.players.pos_x / cell_width), 0, grid_dimension - 1).astype(np.int64)
+        cell_row = np.clip(np.floor(self.players.pos_y / cell_height), 0, grid_dimension - 1).astype(np.int64)
+        self.players.server[:] = self.cell_servers[cell_row * grid_dimension + cell_column]
+        update_player_counts(self.players, self.server_list)
+        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(verbose=self.verbose)
         self.stop_timer()
         self.data_output[TRIES] = [{
             INVALID: invalid_distribution,
             TIME_ELAPSED: self.time_elapsed,
             TOTAL_FWDS: total_forwards,
             FWDS_BY_SERVER: forwards_by_server,
-            PLAYER_LIST: deepcopy(self.players_list),
-            SERVER_LIST: deepcopy(self.server_list)
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
         }]
         self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
         self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
-        return self.frontiers, self.players_list
+        return self.frontiers, self.players
 
     def plot_map(self, save_file=True, show_plot=True):
         cmap, plt, full_path = super().plot_map()
@@ -1,36 +1,41 @@
-from copy import deepcopy
-
 from methods.Method import Method
-from utils.Constants import ID, PLAYER_COUNT, SERVER, TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, FWDS_BY_SERVER, \
-    PLAYER_LIST, SERVER_LIST, MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.AsyncLogger import get_logger
+from utils.Constants import TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, FWDS_BY_SERVER, PLAYER_LIST, SERVER_LIST, \
+    MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.ServerUtils import update_player_counts
 
 
 class Hashing(Method):
     def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
                  forward_weight,
-                 verbose=False, fixed_seeds=False):
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, scenario=None,
+                 visibility_radius=None):
         super().__init__(player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
-                         forward_weight, verbose, fixed_seeds)
+                         forward_weight, verbose, fixed_seeds, neighbor_backend,
+                         approximate_interest_groups, scenario=scenario,
+                         visibility_radius=visibility_radius)
         self.method_name = "Hashing Method"
 
     def allocate_players(self):
         self.start_timer()
         super().allocate_players()
         number_of_servers = len(self.server_list)
-        for player in self.players_list:
-            self.server_list[player[ID] % number_of_servers][PLAYER_COUNT] += 1
-            player[SERVER] = player[ID] % number_of_servers
-            if self.verbose:
-                print(f"Player {player[ID]} allocated in server {player[SERVER]}")
-        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(self.players_list, self.interest_groups)
+        self.players.server[:] = self.players.ids % number_of_servers
+        update_player_counts(self.players, self.server_list)
+        if self.verbose:
+            get_logger().player_events("Player {player} allocated in server {server}", player=self.players.ids,
+                                       server=self.players.server)
+        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(verbose=self.verbose)
         self.stop_timer()
         self.data_output[TRIES] = [{
             INVALID: invalid_distribution,
             TIME_ELAPSED: self.time_elapsed,
             TOTAL_FWDS: total_forwards,
             FWDS_BY_SERVER: forwards_by_server,
-            PLAYER_LIST: deepcopy(self.players_list),
-            SERVER_LIST: deepcopy(self.server_list)
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
         }]
         self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
         self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
@@ -39,7 +44,7 @@ class Hashing(Method):
     def plot_map(self, save_file=True, show_plot=True):
         cmap, plt, full_path = super().plot_map()
         for server_idx, server in enumerate(self.server_list):
-            plt.scatter(-50, -50, c=cmap(server_idx), marker="s", s=100, label=f"Server {server_idx}")
+            plt.scatter(-50, -50, color=cmap(server_idx), marker="s", s=100, label=f"Server {server_idx}")
         plt.legend()
         if save_file:
             plt.savefig(full_path)
@@ -0,0 +1,80 @@
+import numpy as np
+
+from methods.Method import Method
+from utils.Constants import SERVER, X_MIN, Y_MIN, Y_MAX, X_MAX, TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, \
+    FWDS_BY_SERVER, PLAYER_LIST, SERVER_LIST, MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.ServerUtils import update_player_counts
+
+
+class KdPartition(Method):
+    def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                 forward_weight,
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, scenario=None,
+                 visibility_radius=None):
+        super().__init__(player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                         forward_weight, verbose, fixed_seeds, neighbor_backend, approximate_interest_groups,
+                         scenario=scenario,
+                         visibility_radius=visibility_radius)
+        self.method_name = "K-d Partition Method"
+        self.frontiers = []
+
+    def allocate_players(self):
+        self.start_timer()
+        super().allocate_players()
+        self.frontiers = []
+        region = {X_MIN: 0, X_MAX: self.map_size_x, Y_MIN: 0, Y_MAX: self.map_size_y}
+        self.split_region(self.players.ids, region, 0, len(self.server_list))
+        update_player_counts(self.players, self.server_list)
+        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(verbose=self.verbose)
+        self.stop_timer()
+        self.data_output[TRIES] = [{
+            INVALID: invalid_distribution,
+            TIME_ELAPSED: self.time_elapsed,
+            TOTAL_FWDS: total_forwards,
+            FWDS_BY_SERVER: forwards_by_server,
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
+        }]
+        self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
+        self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
+        return self.frontiers, self.players
+
+    def split_region(self, player_ids, region, first_server, last_server):
+        """Recursively bisects a region across its longer side, giving each half a share of the players
+        proportional to its share of the servers [first_server, last_server)"""
+        number_of_servers = last_server - first_server
+        if number_of_servers == 1:
+            self.players.server[player_ids] = first_server
+            self.frontiers.append({**region, SERVER: first_server})
+            return
+        left_servers = number_of_servers // 2
+        split_idx = int(round(len(player_ids) * left_servers / number_of_servers))
+        split_x = region[X_MAX] - region[X_MIN] >= region[Y_MAX] - region[Y_MIN]
+        low, high = (X_MIN, X_MAX) if split_x else (Y_MIN, Y_MAX)
+        coordinates = self.players.positions[player_ids, 0 if split_x else 1]
+        if 0 < split_idx < len(player_ids):
+            order = np.argpartition(coordinates, split_idx)
+            split_value = float(coordinates[order[split_idx]])
+        else:  # too few players to share, the region is split in the middle
+            order = np.arange(len(player_ids))
+            split_value = (region[low] + region[high]) / 2
+        self.split_region(player_ids[order[:split_idx]], {**region, high: split_value},
+                          first_server, first_server + left_servers)
+        self.split_region(player_ids[order[split_idx:]], {**region, low: split_value},
+                          first_server + left_servers, last_server)
+
+    def plot_map(self, save_file=True, show_plot=True):
+        cmap, plt, full_path = super().plot_map()
+        for region in self.frontiers:
+            color = cmap(region[SERVER])
+            plt.vlines(x=[region[X_MIN], region[X_MAX]], ymin=region[Y_MIN], ymax=region[Y_MAX], color=color,
+                       label=f"Server {region[SERVER]}")
+            plt.hlines(y=[region[Y_MIN], region[Y_MAX]], xmin=region[X_MIN], xmax=region[X_MAX], color=color)
+        plt.legend()
+        plt.grid(False)
+        if save_file:
+            plt.savefig(full_path)
+        if show_plot:
+            plt.show()
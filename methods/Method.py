@@ -1,16 +1,23 @@
 import abc
+import copy
 from random import seed
-from time import time
+from time import perf_counter_ns
 
 import numpy as np
-from pybloom_live import BloomFilter
-import matplotlib.pyplot as plt
 
-from utils.Constants import POS_X, POS_Y, SERVER, PLAYER_COUNT
+from utils.AsyncLogger import get_logger
+from utils.Constants import POS_X, POS_Y, PLAYER_COUNT, LOAD, TOTAL_FWDS, FWDS_BY_SERVER, INVALID, \
+    PLAYER_LIST, SERVER_LIST, TRIES, TIME_ELAPSED, MIGRATIONS, MIN_FWD, TOTAL_TIME_ELAPSED, PROFILE, \
+    MAX_SERVER_LOAD
+from utils.IncrementalEvaluation import IncrementalEvaluator, REPLACE_SHARE
 from utils.Initialization import generate_players, generate_servers
+from utils.NeighborSearch import generate_neighbor_backend, KDTREE_BACKEND
 from utils.OutputUtils import get_output_path
-from utils.ServerUtils import calculate_viewable_players, calculate_load_factors, publish_interest_groups
-from utils.SpatialIndex import generate_spatial_index
+from utils.PlayerStore import PlayerStore, UNALLOCATED
+from utils.Profiling import PhaseProfiler, phase, write_report, PLAYER_GENERATION_PHASE, INDEX_BUILD_PHASE, \
+    ASSIGNMENT_PHASE, OUTPUT_PHASE
+from utils.Rebalancing import place_orphans, split_servers, rebalance_allocation, count_migrations
+from utils.ServerUtils import calculate_viewable_players, evaluate_allocation
 
 
 class Method:
@@ -18,30 +25,88 @@ class Method:
 
     def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
                  forward_weight,
-                 verbose=False, fixed_seeds=False):
+                 verbose=False, fixed_seeds=False, neighbor_backend=KDTREE_BACKEND,
+                 approximate_interest_groups=False, scenario=None, visibility_radius=None):
+        if visibility_radius is not None and visibility_radius <= 0:
+            raise ValueError(f"The visibility radius must be positive, got {visibility_radius}")
+        if scenario is not None:
+            self.check_scenario(scenario, player_count, map_size_x, map_size_y, viewable_players)
         self.player_count = player_count
         self.server_count = server_count
         self.map_size_x = map_size_x
         self.map_size_y = map_size_y
-        self.players_list = generate_players(self.player_count, self.map_size_x, self.map_size_y)
-        self.server_list = generate_servers(self.server_count)
-        self.players_spatial_index = generate_spatial_index(self.players_list)
-        self.interest_groups = [BloomFilter(self.player_count ** 2, error_rate=0.1) for _ in self.server_list]
-        self.server_capacity = server_capacity
-        self.viewable_players = viewable_players
-        self.forward_weight = forward_weight
-        self.load_factor_own_cost = 100 / self.server_capacity
-        self.load_factor_forward_cost = self.load_factor_own_cost * self.forward_weight
-        self.verbose = verbose
-        self.start_time = 0
-        self.end_time = 0
-        self.time_elapsed = 0
-        self.data_output = {}
-        self.method_name = ''
         self.fixed_seeds = fixed_seeds
-        if self.fixed_seeds:
-            self.set_fixed_seeds()
-        calculate_viewable_players(self.players_list, self.players_spatial_index, self.viewable_players)
+        self.scenario = scenario
+        self.neighbor_backend_name = neighbor_backend
+        # phase timers, always on; enable_profiling adds the cProfile and tracemalloc hooks
+        self.profiler = PhaseProfiler()
+        self.profiler.activate()
+        try:
+            if self.fixed_seeds:
+                self.set_fixed_seeds()
+            if scenario is None:
+                with phase(PLAYER_GENERATION_PHASE):
+                    self.players = generate_players(self.player_count, self.map_size_x, self.map_size_y)
+                with phase(INDEX_BUILD_PHASE):
+                    self.neighbor_backend = generate_neighbor_backend(self.players, neighbor_backend)
+            else:
+                if self.fixed_seeds and scenario.random_state is not None:
+                    np.random.set_state(scenario.random_state)
+                self.players = scenario.create_players()
+                with phase(INDEX_BUILD_PHASE):
+                    self.neighbor_backend = scenario.get_neighbor_backend(neighbor_backend)
+            self.server_list = generate_servers(self.server_count)
+            self.server_capacity = server_capacity
+            self.viewable_players = viewable_players
+            # without a radius each player sees its viewable_players nearest players, with one every player within it
+            self.visibility_radius = visibility_radius
+            self.forward_weight = forward_weight
+            self.load_factor_own_cost = MAX_SERVER_LOAD / self.server_capacity
+            self.load_factor_forward_cost = self.load_factor_own_cost * self.forward_weight
+            self.verbose = verbose
+            self.approximate_interest_groups = approximate_interest_groups
+            self.incremental_evaluator = None
+            self.start_time = 0
+            self.end_time = 0
+            self.time_elapsed = 0
+            self.data_output = {}
+            self.method_name = ''
+            if scenario is None or visibility_radius is not None:
+                calculate_viewable_players(self.players, self.neighbor_backend, self.viewable_players,
+                                           radius=visibility_radius)
+        finally:
+            self.profiler.deactivate()
+
+    @classmethod
+    def from_scenario(cls, scenario, server_count, server_capacity, forward_weight, **kwargs):
+        """Builds the method over a shared scenario, reusing its players, spatial index and neighbors"""
+        return cls(scenario.player_count, server_count, scenario.map_size_x, scenario.map_size_y, server_capacity,
+                   scenario.viewable_players, forward_weight, scenario=scenario, **kwargs)
+
+    @staticmethod
+    def check_scenario(scenario, player_count, map_size_x, map_size_y, viewable_players):
+        """Raises a ValueError when the method parameters disagree with the scenario it is built from"""
+        expected = {'player_count': player_count, 'map_size_x': map_size_x, 'map_size_y': map_size_y,
+                    'viewable_players': viewable_players}
+        mismatches = {name: (value, scenario.parameters[name]) for name, value in expected.items()
+                      if value != scenario.parameters[name]}
+        if mismatches:
+            raise ValueError(f"Method parameters disagree with the scenario (method, scenario): {mismatches}")
+
+    def detach_from_scenario(self):
+        """Gives the method its own copy of the scenario players and spatial index, before changing them"""
+        if self.scenario is None:
+            return
+        self.players = PlayerStore(self.players.positions.copy(), server=self.players.server,
+                                   neighbors=self.players.neighbors.copy())
+        self.neighbor_backend = generate_neighbor_backend(self.players, self.neighbor_backend_name)
+        self.incremental_evaluator = None
+        self.scenario = None
+
+    @property
+    def players_list(self):
+        """The players, for code written against the list of player dicts (see PlayerView)"""
+        return self.players
 
     def set_fixed_seeds(self):
         """Sets fixed seeds"""
@@ -49,58 +114,180 @@ class Method:
         seed(930)
 
     def start_timer(self):
-        """Starts a timer to measure execution time"""
-        self.start_time = time()
+        """Starts a timer to measure execution time, profiling the allocation phases until stop_timer"""
+        if not self.profiler.active:
+            self.profiler.activate()
+            self.profiler.start_phase(ASSIGNMENT_PHASE)
+        self.start_time = perf_counter_ns() / 1e9
 
     def stop_timer(self):
         """Stops the timer and calculates the elapsed time"""
-        self.end_time = time()
+        self.end_time = perf_counter_ns() / 1e9
         self.time_elapsed = self.end_time - self.start_time
+        if self.profiler.active:
+            self.profiler.deactivate()
+        self.data_output[PROFILE] = self.profiler.report()
         if self.verbose:
-            print(f"{self.method_name} time elapsed: {self.time_elapsed} seconds")
+            get_logger().info(f"{self.method_name} time elapsed: {self.time_elapsed} seconds")
+
+    def enable_profiling(self, cprofile=False, trace_memory=False):
+        """Adds a cProfile of the allocations and the peak traced memory of each phase to the profiling report"""
+        self.profiler.enable_hooks(cprofile, trace_memory)
+
+    def write_profile_report(self, path=None):
+        """Writes the profiling report (phase times, call counts, memory peaks) as JSON, returning its path"""
+        if path is None:
+            method = "_".join(self.method_name.split(' ')).lower()
+            path = get_output_path("profiles", f"profile_{method}_{self.player_count}_{self.server_count}.json")
+        report = {'method': self.method_name, 'player_count': self.player_count, 'server_count': self.server_count,
+                  'viewable_players': self.viewable_players, 'visibility_radius': self.visibility_radius,
+                  **self.profiler.report()}
+        write_report(report, str(path))
+        return path
+
+    def evaluate_allocation(self):
+        """Evaluates the current allocation in a single pass, updating each server's load and player count"""
+        evaluation = evaluate_allocation(self.players, len(self.server_list), self.load_factor_own_cost,
+                                         self.load_factor_forward_cost, self.approximate_interest_groups)
+        self.store_server_loads(evaluation)
+        return evaluation
+
+    def store_server_loads(self, evaluation):
+        """Copies the loads and player counts of an evaluation into the servers"""
+        for server, load, player_count in zip(self.server_list, evaluation[LOAD], evaluation[PLAYER_COUNT]):
+            server[LOAD] = load
+            server[PLAYER_COUNT] = player_count
+
+    def restore_try(self, try_data):
+        """Rebuilds the full players allocation and server state from a compact try record"""
+        self.players.server[:] = try_data[PLAYER_LIST]
+        if try_data[SERVER_LIST] is not None:
+            for server, (x, y) in zip(self.server_list, try_data[SERVER_LIST].tolist()):
+                server[POS_X] = x
+                server[POS_Y] = y
+        return self.evaluate_allocation()
+
+    def create_incremental_evaluator(self):
+        """Returns an incremental evaluator over the current allocation, for moving players one at a time"""
+        return IncrementalEvaluator(self.players, len(self.server_list), self.load_factor_own_cost,
+                                    self.load_factor_forward_cost)
 
     def calculate_number_of_forwards_per_server(self, print_focuses=True, verbose=False):
         """Calculates the number of forwards done by each server based on its players list"""
+        evaluation = self.evaluate_allocation()
+        self.print_evaluation(evaluation, print_focuses, verbose)
+        return evaluation[TOTAL_FWDS], evaluation[FWDS_BY_SERVER], evaluation[INVALID]
+
+    def rebalance_players(self, previous_assignment, server_count=None, migration_weight=1.0, overload_weight=10.0,
+                          passes=3, changed_ids=None):
+        """Rebalances from a previous assignment to the current state (moved players, new server count) with a local
+        search trading migrations, weighted by migration_weight, against forwards and overload. changed_ids are the
+        players that moved or whose neighbors changed since the previous assignment"""
+        self.start_timer()
+        previous_assignment = np.asarray(previous_assignment)
+        previous_server_count = len(self.server_list)
+        if server_count is not None and server_count != previous_server_count:
+            self.server_count = server_count
+            self.server_list = generate_servers(server_count)
         number_of_servers = len(self.server_list)
-        number_of_forwards_by_server = [0] * number_of_servers
-        interest_groups = publish_interest_groups(self.players_list, self.server_list)
-        invalid = False
-        for interest_group_idx, interest_group in enumerate(interest_groups):
-            number_of_forwards_by_server[interest_group_idx] = interest_group.count
-        if verbose:
-            for interest_group_idx in range(number_of_servers):
-                print(f"Server {interest_group_idx}: {number_of_forwards_by_server[interest_group_idx]} forwards")
-        if print_focuses:
-            print(f"Total forwards: {sum(number_of_forwards_by_server)}")
-            servers_load = calculate_load_factors(self.server_list, self.load_factor_own_cost, self.load_factor_forward_cost, publish_interest_groups(self.players_list, self.server_list))
-            if any(load > 100 for load in servers_load):
-                print("Unviable partitioning.")
-                invalid = True
-            print(f"Server loads: {servers_load}")
-            print(f"Player counts: {[server[PLAYER_COUNT] for server in self.server_list]}")
-            return sum(number_of_forwards_by_server), number_of_forwards_by_server, invalid
+        self.players.server[:] = previous_assignment
+        orphans = np.flatnonzero((previous_assignment >= number_of_servers) | (previous_assignment == UNALLOCATED))
+        if len(orphans) == len(self.players):
+            raise ValueError("The previous assignment has no player in any of the current servers")
+        if len(orphans) > 0:
+            place_orphans(self.players, orphans)
+        split_servers(self.players, previous_server_count, number_of_servers)
+        reassigned_ids = np.flatnonzero(self.players.server != previous_assignment)
+        evaluator = self.incremental_evaluator
+        if evaluator is None or evaluator.server_count != number_of_servers or len(reassigned_ids) > 0 or \
+                not evaluator.tracks(previous_assignment):
+            evaluator = self.incremental_evaluator = self.create_incremental_evaluator()
+        seed_ids = reassigned_ids if changed_ids is None else np.concatenate([reassigned_ids, changed_ids])
+        rebalance_allocation(evaluator, previous_assignment, migration_weight, overload_weight, passes, seed_ids)
+        evaluation = evaluator.evaluation()
+        self.store_server_loads(evaluation)
+        evaluation[MIGRATIONS] = count_migrations(previous_assignment, self.players.server)
+        self.stop_timer()
+        self.print_evaluation(evaluation, verbose=self.verbose)
+        self.data_output[TRIES] = [{
+            INVALID: evaluation[INVALID],
+            TIME_ELAPSED: self.time_elapsed,
+            TOTAL_FWDS: evaluation[TOTAL_FWDS],
+            MIGRATIONS: evaluation[MIGRATIONS],
+            FWDS_BY_SERVER: evaluation[FWDS_BY_SERVER],
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
+        }]
+        self.data_output[MIN_FWD] = evaluation[TOTAL_FWDS]
+        self.data_output[TOTAL_TIME_ELAPSED] = self.time_elapsed
+        return evaluation
+
+    def players_moved(self, player_ids):
+        """Called after players moved, for methods caching state derived from the player positions"""
+
+    def neighbors_replaced(self, player_ids, old_neighbors):
+        """Called after the neighbors of the given players were searched again, old_neighbors holding their previous
+        rows, so the incremental evaluator kept for rebalancing follows the visibility graph"""
+        if self.incremental_evaluator is None:
+            return
+        if len(player_ids) > REPLACE_SHARE * len(self.players):
+            self.incremental_evaluator = None
         else:
-            servers_load = calculate_load_factors(self.server_list, publish_interest_groups(self.players_list, self.server_list))
-            if any(load > 100 for load in servers_load):
-                invalid = True
+            self.incremental_evaluator.replace_neighbors(player_ids, old_neighbors)
 
-            return sum(number_of_forwards_by_server), number_of_forwards_by_server, invalid
+    @staticmethod
+    def print_evaluation(evaluation, print_focuses=True, verbose=False):
+        """Prints the forwards, loads and player counts of an evaluation"""
+        with phase(OUTPUT_PHASE):
+            logger = get_logger()
+            if verbose:
+                for server_idx, number_of_forwards in enumerate(evaluation[FWDS_BY_SERVER]):
+                    logger.info(f"Server {server_idx}: {number_of_forwards} forwards")
+            if print_focuses:
+                logger.info(f"Total forwards: {evaluation[TOTAL_FWDS]}")
+                if MIGRATIONS in evaluation:
+                    logger.info(f"Migrations: {evaluation[MIGRATIONS]}")
+                if evaluation[INVALID]:
+                    logger.info("Unviable partitioning.")
+                logger.info(f"Server loads: {evaluation[LOAD]}")
+                logger.info(f"Player counts: {evaluation[PLAYER_COUNT]}")
 
     @abc.abstractmethod
     def allocate_players(self):
         """Allocates players using a method"""
-        print(f"----------------{self.method_name}----------------")
+        get_logger().info(f"----------------{self.method_name}----------------")
+
+    def plot_snapshot(self):
+        """Returns a light copy of the method with what plot_map draws, to plot it later while the method goes on:
+        the player positions and assignment and the server list are copied, while the spatial index, incremental
+        evaluator, scenario and profiler are left out"""
+        snapshot = copy.copy(self)
+        snapshot.players = PlayerStore(self.players.positions.copy(), server=self.players.server.copy())
+        snapshot.server_list = copy.deepcopy(self.server_list)
+        snapshot.neighbor_backend = None
+        snapshot.incremental_evaluator = None
+        snapshot.scenario = None
+        snapshot.profiler = None
+        snapshot.data_output = {}
+        return snapshot
 
     @abc.abstractmethod
     def plot_map(self, save_file=True, show_plot=True):
-        """Plots the map for visualization"""
-        cmap = plt.cm.get_cmap("tab20", self.server_count + 1)
-        for player in self.players_list:
-            plt.scatter(player[POS_X], player[POS_Y], c=cmap(player[SERVER]), alpha=0.7)
+        """Plots the map for visualization, drawing the players of each server in a single scatter"""
+        import matplotlib.pyplot as plt
+
+        plt.figure()
+        cmap = plt.get_cmap("tab20", self.server_count + 1)
+        order = np.argsort(self.players.server, kind='stable')
+        servers, first_players = np.unique(self.players.server[order], return_index=True)
+        for server, server_players in zip(servers.tolist(), np.split(order, first_players[1:])):
+            positions = self.players.positions[server_players]
+            plt.scatter(positions[:, 0], positions[:, 1], color=cmap(server), alpha=0.7)
         plt.axis([0, self.map_size_x + 5, 0, self.map_size_y + 5])
         plt.title(self.method_name)
         plt.grid(True)
         method = "_".join(self.method_name.split(' '))
         filename = f"map_{method.lower()}_{self.player_count}_{self.server_count}.png"
         full_path = get_output_path("maps", filename)
+        full_path.parent.mkdir(parents=True, exist_ok=True)
         return cmap, plt, full_path
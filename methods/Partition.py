@@ -1,17 +1,27 @@
-from copy import deepcopy
+import numpy as np
 
 from methods.Method import Method
-from utils.Constants import ID, PLAYER_COUNT, SERVER, POS_X, POS_Y, TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, \
+from utils.AsyncLogger import get_logger
+from utils.Constants import TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, \
     FWDS_BY_SERVER, PLAYER_LIST, SERVER_LIST, MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.ServerUtils import update_player_counts
 
 
 class Partition(Method):
     def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
                  forward_weight,
-                 verbose=False, fixed_seeds=False):
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, frontiers=None, scenario=None,
+                 visibility_radius=None):
         super().__init__(player_count, server_count, map_size_x,
                          map_size_y, server_capacity, viewable_players,
-                         forward_weight, verbose, fixed_seeds)
+                         forward_weight, verbose, fixed_seeds, neighbor_backend,
+                         approximate_interest_groups, scenario=scenario,
+                         visibility_radius=visibility_radius)
+        if frontiers is not None and (len(frontiers) != server_count - 1 or np.any(np.diff(frontiers) < 0)):
+            raise ValueError(f"Expected {server_count - 1} non-decreasing frontiers, got {list(frontiers)}")
+        self.custom_frontiers = frontiers
         self.frontiers = []
         self.method_name = "Partition Method"
 
@@ -19,45 +29,38 @@ class Partition(Method):
         self.start_timer()
         super().allocate_players()
         number_of_servers = len(self.server_list)
-        for i in range(number_of_servers - 1):
-            self.frontiers.append((i + 1) * (self.map_size_x / number_of_servers))
-        for player in self.players_list:
-            if player[POS_X] < self.frontiers[0]:
-                self.server_list[0][PLAYER_COUNT] += 1
-                player[SERVER] = 0
-                if self.verbose:
-                    print(
-                        f"Player {player[ID]} allocated in server {0} - Coordinates({player[POS_X]},{player[POS_Y]}) - Frontier: < {self.frontiers[0]}")
-
-            elif player[POS_X] >= self.frontiers[-1]:
-                self.server_list[-1][PLAYER_COUNT] += 1
-                player[SERVER] = self.server_list[-1][ID]
-                if self.verbose:
-                    print(
-                        f"Player {player[ID]} allocated in server {number_of_servers - 1} - Coordinates({player[POS_X]},{player[POS_Y]}) - Frontier: > {self.frontiers[-1]}")
-
-            for i in range(len(self.frontiers) - 1):
-                if self.frontiers[i] <= player[POS_X] < self.frontiers[i + 1]:
-                    self.server_list[i + 1][PLAYER_COUNT] += 1
-                    player[SERVER] = i + 1
-                    if self.verbose:
-                        print(
-                            f"Player {player[ID]} allocated in server {i + 1} - Coordinates({player[POS_X]},{player[POS_Y]}) - Frontier: {self.frontiers[i]} <= x < {self.frontiers[i + 1]}")
-        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(
-            self.players_list, self.interest_groups)
+        self.frontiers = self.get_frontiers(number_of_servers)
+        # strip i + 1 holds frontiers[i] <= x < frontiers[i + 1]
+        self.players.server[:] = np.searchsorted(self.frontiers, self.players.pos_x, side='right')
+        update_player_counts(self.players, self.server_list)
+        if self.verbose:
+            frontier_descriptions = [f"< {self.frontiers[0]}"] + \
+                                    [f"{low} <= x < {high}" for low, high in zip(self.frontiers, self.frontiers[1:])] + \
+                                    [f"> {self.frontiers[-1]}"] if number_of_servers > 1 else ["any x"]
+            get_logger().player_events(
+                "Player {player} allocated in server {server} - Coordinates({x},{y}) - Frontier: {frontier}",
+                player=self.players.ids, server=self.players.server, x=self.players.pos_x, y=self.players.pos_y,
+                frontier=np.array(frontier_descriptions)[self.players.server])
+        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(verbose=self.verbose)
         self.stop_timer()
         self.data_output[TRIES] = [{
             INVALID: invalid_distribution,
             TIME_ELAPSED: self.time_elapsed,
             TOTAL_FWDS: total_forwards,
             FWDS_BY_SERVER: forwards_by_server,
-            PLAYER_LIST: deepcopy(self.players_list),
-            SERVER_LIST: deepcopy(self.server_list)
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
         }]
         self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
         self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
         return self.frontiers
 
+    def get_frontiers(self, number_of_servers):
+        """Returns the x coordinates splitting the map into one vertical strip per server"""
+        if self.custom_frontiers is not None:
+            return [float(frontier) for frontier in self.custom_frontiers]
+        return [(i + 1) * (self.map_size_x / number_of_servers) for i in range(number_of_servers - 1)]
+
     def plot_map(self, save_file=True, show_plot=True):
         cmap, plt, full_path = super().plot_map()
         plt.axvline(x=0, c=cmap(0), label="Server 0")
@@ -0,0 +1,23 @@
+import numpy as np
+
+from methods.Partition import Partition
+from utils.NeighborSearch import KDTREE_BACKEND
+
+
+class QuantilePartition(Partition):
+    def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                 forward_weight,
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, scenario=None,
+                 visibility_radius=None):
+        super().__init__(player_count, server_count, map_size_x,
+                         map_size_y, server_capacity, viewable_players,
+                         forward_weight, verbose, fixed_seeds, neighbor_backend,
+                         approximate_interest_groups, scenario=scenario,
+                         visibility_radius=visibility_radius)
+        self.method_name = "Quantile Partition Method"
+
+    def get_frontiers(self, number_of_servers):
+        """Returns the x quantiles splitting the players into strips with the same number of players"""
+        quantiles = np.arange(1, number_of_servers) / number_of_servers
+        return np.quantile(self.players.pos_x, quantiles).tolist()
@@ -0,0 +1,88 @@
+import numpy as np
+
+from methods.Method import Method
+from utils.AsyncLogger import get_logger
+from utils.Constants import TRIES, INVALID, TIME_ELAPSED, TOTAL_FWDS, FWDS_BY_SERVER, PLAYER_LIST, SERVER_LIST, \
+    MIN_FWD, TOTAL_TIME_ELAPSED
+from utils.Initialization import generate_servers
+from utils.NeighborSearch import KDTREE_BACKEND
+from utils.ServerUtils import update_player_counts
+from utils.SpaceFillingCurves import HILBERT_CURVE, CURVE_BITS, curve_keys, split_curve_order, \
+    balanced_chunk_sizes
+
+
+class SpaceFillingCurve(Method):
+    def __init__(self, player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                 forward_weight,
+                 verbose=False, fixed_seeds=False,
+                 neighbor_backend=KDTREE_BACKEND, approximate_interest_groups=False, curve=HILBERT_CURVE,
+                 curve_bits=CURVE_BITS, scenario=None,
+                 visibility_radius=None):
+        super().__init__(player_count, server_count, map_size_x, map_size_y, server_capacity, viewable_players,
+                         forward_weight, verbose, fixed_seeds, neighbor_backend,
+                         approximate_interest_groups, scenario=scenario,
+                         visibility_radius=visibility_radius)
+        self.method_name = "Space-Filling Curve Method"
+        self.curve = curve
+        self.curve_bits = curve_bits
+        self.curve_order = None
+
+    def sort_along_curve(self):
+        """Sorts the players along the curve once, later allocations and rebalancing only cut the sorted order"""
+        if self.curve_order is None:
+            keys = curve_keys(self.players.positions, self.map_size_x, self.map_size_y, self.curve,
+                              self.curve_bits)
+            self.curve_order = np.argsort(keys, kind='stable')
+        return self.curve_order
+
+    def players_moved(self, player_ids):
+        """The players must be sorted along the curve again on the next allocation"""
+        self.curve_order = None
+
+    def allocate_players(self):
+        self.start_timer()
+        super().allocate_players()
+        self.sort_along_curve()
+        self.cut_curve()
+        return self.server_list
+
+    def rebalance(self, server_count):
+        """Reallocates the players to a new number of servers, reusing the sorted curve order"""
+        self.start_timer()
+        self.server_count = server_count
+        self.server_list = generate_servers(server_count)
+        self.sort_along_curve()
+        self.cut_curve()
+        return self.server_list
+
+    def cut_curve(self):
+        """Cuts the sorted players into contiguous chunks balanced by server capacity and records the try"""
+        number_of_servers = len(self.server_list)
+        chunk_sizes = balanced_chunk_sizes(len(self.players), [self.server_capacity] * number_of_servers)
+        self.players.server[:] = split_curve_order(self.curve_order, chunk_sizes)
+        update_player_counts(self.players, self.server_list)
+        if self.verbose:
+            get_logger().player_events("Player {player} allocated in server {server}", player=self.players.ids,
+                                       server=self.players.server)
+        total_forwards, forwards_by_server, invalid_distribution = self.calculate_number_of_forwards_per_server(verbose=self.verbose)
+        self.stop_timer()
+        self.data_output[TRIES] = [{
+            INVALID: invalid_distribution,
+            TIME_ELAPSED: self.time_elapsed,
+            TOTAL_FWDS: total_forwards,
+            FWDS_BY_SERVER: forwards_by_server,
+            PLAYER_LIST: self.players.server.copy(),
+            SERVER_LIST: None
+        }]
+        self.data_output[MIN_FWD] = min(self.data_output[TRIES], key=lambda data: data[TOTAL_FWDS])[TOTAL_FWDS]
+        self.data_output[TOTAL_TIME_ELAPSED] = sum(data[TIME_ELAPSED] for data in self.data_output[TRIES])
+
+    def plot_map(self, save_file=True, show_plot=True):
+        cmap, plt, full_path = super().plot_map()
+        for server_idx, server in enumerate(self.server_list):
+            plt.scatter(-50, -50, color=cmap(server_idx), marker="s", s=100, label=f"Server {server_idx}")
+        plt.legend()
+        if save_file:
+            plt.savefig(full_path)
+        if show_plot:
+            plt.show()
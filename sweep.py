@@ -0,0 +1,13 @@
+from utils.Constants import METHOD, TOTAL_FWDS, TOTAL_TIME_ELAPSED
+from utils.Sweep import generate_scenarios, run_sweep, HASHING_METHOD, PARTITION_METHOD, GRID_METHOD, FOCUS_METHOD
+
+if __name__ == '__main__':
+    scenarios = generate_scenarios(methods=[HASHING_METHOD, PARTITION_METHOD, GRID_METHOD, FOCUS_METHOD],
+                                   player_counts=[1000, 5000, 10000],
+                                   server_counts=[4, 8],
+                                   viewable_players=[20, 50],
+                                   server_capacities=[500, 2500],
+                                   forward_weights=[0.4],
+                                   repetitions=3)
+    results = run_sweep(scenarios, verbose=True)
+    print(results.groupby(METHOD)[[TOTAL_FWDS, TOTAL_TIME_ELAPSED]].mean())
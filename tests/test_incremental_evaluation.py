@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from utils.IncrementalEvaluation import IncrementalEvaluator
+from utils.NeighborSearch import generate_neighbor_backend
+from utils.PlayerStore import PlayerStore
+from utils.ServerUtils import calculate_viewable_players, evaluate_allocation
+
+SERVER_COUNT = 4
+OWN_COST = 0.5
+FORWARD_COST = 0.2
+
+
+def random_players(radius=None):
+    rng = np.random.default_rng(0)
+    players = PlayerStore(rng.random((300, 2)) * 100, server=rng.integers(0, SERVER_COUNT, 300))
+    calculate_viewable_players(players, generate_neighbor_backend(players, 'kdtree'), 8, radius=radius)
+    return players
+
+
+@pytest.mark.parametrize('radius', [None, 8.0])
+def test_evaluator_matches_evaluate_allocation_after_moves(radius):
+    players = random_players(radius)
+    evaluator = IncrementalEvaluator(players, SERVER_COUNT, OWN_COST, FORWARD_COST)
+    rng = np.random.default_rng(1)
+    for _ in range(500):
+        if evaluator.history and rng.random() < 0.3:
+            evaluator.undo()
+        else:
+            evaluator.move(int(rng.integers(len(players))), int(rng.integers(SERVER_COUNT)))
+        assert evaluator.evaluation() == evaluate_allocation(players, SERVER_COUNT, OWN_COST, FORWARD_COST)
+
+
+def test_undo_restores_the_allocation():
+    players = random_players()
+    servers = players.server.copy()
+    evaluator = IncrementalEvaluator(players, SERVER_COUNT, OWN_COST, FORWARD_COST)
+    before = evaluator.evaluation()
+    for player_id in range(0, 300, 7):
+        evaluator.move(player_id, (int(players.server[player_id]) + 1) % SERVER_COUNT)
+    while evaluator.history:
+        evaluator.undo()
+    assert (players.server == servers).all()
+    assert evaluator.evaluation() == before
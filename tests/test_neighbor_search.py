@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from methods.Hashing import Hashing
+from utils.NeighborSearch import NEIGHBOR_BACKENDS, generate_neighbor_backend
+from utils.PlayerStore import PlayerStore
+from utils.ServerUtils import calculate_viewable_players
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+@pytest.mark.parametrize('k', [9, 10, 20])
+def test_viewable_players_clamped_to_other_players(backend, k):
+    players = PlayerStore(np.random.default_rng(0).random((10, 2)) * 100)
+    calculate_viewable_players(players, generate_neighbor_backend(players, backend), k)
+    assert players.neighbors.shape == (10, 9)
+    for player_id in range(10):
+        assert sorted(players.neighbors[player_id].tolist()) == [other for other in range(10) if other != player_id]
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_backends_reject_more_neighbors_than_players(backend):
+    players = PlayerStore(np.random.default_rng(0).random((10, 2)) * 100)
+    with pytest.raises(ValueError):
+        generate_neighbor_backend(players, backend).find_k_nearest_players(10)
+
+
+@pytest.mark.parametrize('backend', list(NEIGHBOR_BACKENDS))
+def test_method_with_more_viewable_players_than_players(backend):
+    method = Hashing(10, 2, 100, 100, 500, 20, 0.4, neighbor_backend=backend)
+    assert method.players.neighbors.shape == (10, 9)
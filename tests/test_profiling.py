@@ -0,0 +1,35 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from methods.Hashing import Hashing
+from utils import Profiling
+from utils.Profiling import PhaseProfiler, phase, KNN_PHASE
+from utils.Scenario import Scenario
+
+
+def test_failed_method_setup_leaves_no_active_profiler():
+    scenario = Scenario(100, 100, 100, 5)
+    with pytest.raises(ValueError):
+        Hashing(200, 2, 100, 100, 100, 5, 0.4, scenario=scenario)
+    with pytest.raises(ValueError):
+        Hashing(100, 2, 100, 100, 100, 5, 0.4, neighbor_backend='unknown')
+    assert Profiling.active_profiler is None
+
+
+def test_profiler_keeps_an_outer_tracemalloc_peak():
+    tracemalloc.start()
+    try:
+        block = np.ones(10 ** 6)
+        del block
+        outer_peak = tracemalloc.get_traced_memory()[1]
+        profiler = PhaseProfiler(trace_memory=True)
+        profiler.activate()
+        with phase(KNN_PHASE):
+            np.ones(10)
+        profiler.deactivate()
+        assert tracemalloc.is_tracing()
+        assert tracemalloc.get_traced_memory()[1] >= outer_peak
+    finally:
+        tracemalloc.stop()
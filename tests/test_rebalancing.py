@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from methods.KdPartition import KdPartition
+from utils.Constants import MIGRATIONS, TOTAL_FWDS, LOAD, PLAYER_COUNT
+from utils.Movement import RandomWalk
+from utils.PlayerStore import PlayerStore, UNALLOCATED
+from utils.Rebalancing import place_orphans, count_migrations
+from utils.ServerUtils import evaluate_allocation
+from utils.Simulation import Simulation
+
+
+def allocated_method(server_count=4):
+    np.random.seed(0)
+    method = KdPartition(1000, server_count, 100, 100, 1000, 10, 0.4)
+    method.allocate_players()
+    return method
+
+
+def test_place_orphans_joins_the_nearest_allocated_player():
+    players = PlayerStore(np.array([[0, 0], [10, 0], [1, 0], [9, 0]], dtype=float),
+                          server=np.array([0, 1, UNALLOCATED, UNALLOCATED]))
+    place_orphans(players, np.array([2, 3]))
+    assert players.server.tolist() == [0, 1, 0, 1]
+
+
+def test_count_migrations_ignores_unallocated_players():
+    assert count_migrations(np.array([0, 1, 2, 0]), np.array([0, 2, 2, UNALLOCATED])) == 1
+
+
+@pytest.mark.parametrize('server_count', [3, 5])
+def test_rebalance_to_another_server_count(server_count):
+    method = allocated_method()
+    previous_assignment = method.players.server.copy()
+    evaluation = method.rebalance_players(previous_assignment, server_count=server_count)
+    servers = method.players.server
+    assert servers.min() >= 0 and servers.max() < server_count
+    assert len(np.unique(servers)) == server_count
+    assert evaluation[MIGRATIONS] == count_migrations(previous_assignment, servers)
+    if server_count < 4:
+        # only the players of the removed server have to move
+        assert (servers[previous_assignment == 3] != 3).all()
+    expected = evaluate_allocation(method.players, server_count, method.load_factor_own_cost,
+                                   method.load_factor_forward_cost)
+    assert {key: evaluation[key] for key in (TOTAL_FWDS, LOAD, PLAYER_COUNT)} == \
+        {key: expected[key] for key in (TOTAL_FWDS, LOAD, PLAYER_COUNT)}
+
+
+def test_rebalance_without_changes_keeps_the_allocation():
+    method = allocated_method()
+    previous_assignment = method.players.server.copy()
+    evaluation = method.rebalance_players(previous_assignment, migration_weight=1e9)
+    assert evaluation[MIGRATIONS] == 0
+    assert (method.players.server == previous_assignment).all()
+
+
+def test_kept_evaluator_follows_the_simulation():
+    method = allocated_method()
+    simulation = Simulation(method, RandomWalk(100, 100, 1.0, 0.01), repartition_interval=2, migration_weight=1.0)
+    kept = 0
+    for _ in range(10):
+        evaluator = method.incremental_evaluator
+        simulation.step()
+        if simulation.tick % 2 == 0:
+            kept += evaluator is not None and method.incremental_evaluator is evaluator
+            fresh = method.create_incremental_evaluator()
+            assert (method.incremental_evaluator.references == fresh.references).all()
+            assert method.incremental_evaluator.evaluation() == fresh.evaluation()
+    assert kept > 0
@@ -0,0 +1,34 @@
+import numpy as np
+
+from utils.Scenario import Scenario
+from utils.ScenarioFile import build_scenario_file
+
+
+def assert_same_scenario(loaded, scenario):
+    assert loaded.parameters == scenario.parameters
+    assert (np.asarray(loaded.positions) == scenario.positions).all()
+    assert (np.asarray(loaded.neighbors) == scenario.neighbors).all()
+    algorithm, keys, position, has_gauss, cached_gaussian = loaded.random_state
+    assert (algorithm, position, has_gauss, cached_gaussian) == \
+        (scenario.random_state[0], *scenario.random_state[2:])
+    assert (keys == scenario.random_state[1]).all()
+
+
+def test_saved_scenario_reads_back_the_same(tmp_path):
+    scenario = Scenario(500, 100, 200, 10, seed=3)
+    path = tmp_path / "scenario.bin"
+    scenario.save(path)
+    assert_same_scenario(Scenario.load(path), scenario)
+
+
+def test_built_scenario_file_matches_the_in_memory_scenario(tmp_path):
+    path = tmp_path / "scenario.bin"
+    build_scenario_file(path, 500, 100, 200, 10, 3, chunk_size=128)
+    assert_same_scenario(Scenario.load(path), Scenario(500, 100, 200, 10, seed=3))
+
+
+def test_cached_scenario_is_built_once(tmp_path):
+    first = Scenario.load_or_build(300, 100, 100, 5, seed=1, cache_dir=tmp_path)
+    second = Scenario.load_or_build(300, 100, 100, 5, seed=1, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert_same_scenario(second, first)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from utils.NeighborSearch import generate_neighbor_backend
+from utils.PlayerStore import PlayerStore
+from utils.ServerUtils import calculate_viewable_players, evaluate_allocation
+from utils.StreamingEvaluation import array_chunks, exact_neighbors, streaming_evaluate_allocation
+
+SERVER_COUNT = 4
+K = 10
+OWN_COST = 0.01
+FORWARD_COST = 0.004
+
+
+def players_on(positions, radius=None):
+    players = PlayerStore(positions, server=(np.arange(len(positions)) % SERVER_COUNT).astype(np.int32))
+    calculate_viewable_players(players, generate_neighbor_backend(players, 'kdtree'), K, radius=radius)
+    return players
+
+
+def stream(players, memory_budget, chunk_size, radius=None):
+    return streaming_evaluate_allocation(array_chunks(players.positions, chunk_size), players.server, SERVER_COUNT, K,
+                                         OWN_COST, FORWARD_COST, memory_budget, radius)
+
+
+@pytest.mark.parametrize('memory_budget, chunk_size', [(2 ** 28, 2 ** 18), (2 ** 20, 500), (2 ** 18, 128)])
+@pytest.mark.parametrize('radius', [None, 2.0])
+def test_streaming_matches_in_memory_on_random_players(memory_budget, chunk_size, radius):
+    players = players_on(np.random.default_rng(0).random((3000, 2)) * 100, radius)
+    assert stream(players, memory_budget, chunk_size, radius) == \
+        evaluate_allocation(players, SERVER_COUNT, OWN_COST, FORWARD_COST)
+
+
+def lattice_positions():
+    return np.stack(np.meshgrid(np.arange(60.0), np.arange(60.0)), -1).reshape(-1, 2)
+
+
+def nearest_by_distance_then_id(positions):
+    distances = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    np.fill_diagonal(distances, np.inf)
+    ids = np.broadcast_to(np.arange(len(positions)), distances.shape)
+    return np.lexsort((ids, distances), axis=1)[:, :K].astype(np.int32)
+
+
+def test_streaming_breaks_lattice_ties_by_id():
+    players = players_on(lattice_positions())
+    players.neighbors = nearest_by_distance_then_id(players.positions)
+    expected = evaluate_allocation(players, SERVER_COUNT, OWN_COST, FORWARD_COST)
+    for memory_budget, chunk_size in [(2 ** 28, 2 ** 18), (2 ** 20, 500), (2 ** 18, 128)]:
+        assert stream(players, memory_budget, chunk_size) == expected
+
+
+@pytest.mark.parametrize('chunk_size', [128, 1000])
+def test_exact_neighbors_break_lattice_ties_by_id(chunk_size):
+    positions = lattice_positions()
+    player_ids = np.arange(0, len(positions), 7)
+    neighbors = exact_neighbors(array_chunks(positions, chunk_size), player_ids, positions[player_ids], K)
+    assert (np.sort(neighbors, axis=1) == np.sort(nearest_by_distance_then_id(positions)[player_ids], axis=1)).all()
@@ -0,0 +1,134 @@
+import atexit
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from queue import SimpleQueue
+
+import numpy as np
+
+LOG_BUFFER_LINES = 10000  # formatted lines written at once by the background thread
+
+
+class BufferedLogger:
+    """Log output written by a background thread: callers only enqueue messages (per-player events as whole arrays),
+    the thread formats them and writes them in large buffered batches, so verbose runs do not block on I/O.
+
+    Per-player events are sampled deterministically, keeping every 1 / player_sample_rate-th player, without touching
+    the random state. Without a path the logger writes to the sys.stdout current at write time."""
+
+    def __init__(self, path=None, player_sample_rate=1.0, enabled=True):
+        if not 0 < player_sample_rate <= 1:
+            raise ValueError(f"The player sample rate must be in (0, 1], got {player_sample_rate}")
+        self.path = path
+        self.sample_stride = max(int(round(1 / player_sample_rate)), 1)
+        self.enabled = enabled
+        self.queue = SimpleQueue()
+        self.flushed = threading.Event()
+        self.file = None
+        self.thread = None
+        self.closed = False
+
+    def start(self):
+        if self.closed:
+            raise ValueError("Logging to a closed logger")
+        if self.thread is None:
+            if self.path is not None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self.file = open(self.path, 'w')
+            self.thread = threading.Thread(target=self.write_messages, name="BufferedLogger", daemon=True)
+            self.thread.start()
+
+    def info(self, message):
+        """Enqueues a message"""
+        if self.enabled:
+            self.start()
+            self.queue.put((message, None))
+
+    def player_events(self, template, **columns):
+        """Enqueues one event per sampled player, formatting the template with the matching element of each column
+        (player ids, servers, coordinates...) on the background thread"""
+        if self.enabled:
+            self.start()
+            # copies, the callers keep changing their arrays while the events wait in the queue
+            self.queue.put((template, {name: np.array(np.asarray(column)[::self.sample_stride])
+                                       for name, column in columns.items()}))
+
+    def write_messages(self):
+        lines = []
+        while True:
+            message = self.queue.get()
+            if message is None:
+                break
+            if message is self.flushed:
+                self.write_lines(lines)
+                self.stream().flush()
+                self.flushed.set()
+                continue
+            template, columns = message
+            if columns is None:
+                lines.append(template)
+            else:
+                names = list(columns)
+                for values in zip(*(columns[name].tolist() for name in names)):
+                    lines.append(template.format(**dict(zip(names, values))))
+            if len(lines) >= LOG_BUFFER_LINES or self.queue.empty():
+                self.write_lines(lines)
+        self.write_lines(lines)
+        self.stream().flush()
+
+    def stream(self):
+        return self.file if self.file is not None else sys.stdout
+
+    def write_lines(self, lines):
+        if lines:
+            self.stream().write("\n".join(lines) + "\n")
+            lines.clear()
+
+    def flush(self):
+        """Blocks until every enqueued message is written"""
+        if self.thread is not None and self.thread.is_alive():
+            self.flushed.clear()
+            self.queue.put(self.flushed)
+            self.flushed.wait()
+
+    def close(self):
+        """Writes the pending messages and stops the background thread"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+logger = BufferedLogger()
+atexit.register(lambda: logger.close())
+
+
+def get_logger():
+    """Returns the logger the methods write their output to"""
+    return logger
+
+
+def configure_logging(path=None, player_sample_rate=1.0, enabled=True):
+    """Replaces the method logger, writing the output of the previous one first"""
+    global logger
+    logger.close()
+    logger = BufferedLogger(path, player_sample_rate, enabled)
+    return logger
+
+
+@contextmanager
+def silenced_logging():
+    """Drops the method output inside the block"""
+    global logger
+    previous_logger, logger = logger, BufferedLogger(enabled=False)
+    try:
+        yield
+    finally:
+        logger = previous_logger
@@ -20,3 +20,25 @@ FWDS_BY_SERVER = 'fwds_by_server'
 TOTAL_TIME_ELAPSED = 'total_time_elapsed'
 PLAYER_LIST = 'player_list'
 SERVER_LIST = 'server_list'
+SPILL_RATIO = 'spill_ratio'
+REFINEMENT_FWDS = 'refinement_fwds'
+REFINEMENT_TIMES = 'refinement_times'
+TICK = 'tick'
+TICK_LATENCY = 'tick_latency'
+MIGRATIONS = 'migrations'
+MOVED_PLAYERS = 'moved_players'
+UPDATED_NEIGHBORS = 'updated_neighbors'
+REPARTITIONED = 'repartitioned'
+SIMULATION_TICKS = 'simulation_ticks'
+METHOD = 'method'
+SEED = 'seed'
+SCENARIO_KEY = 'scenario_key'
+METHOD_OPTIONS = 'method_options'
+SETUP_TIME = 'setup_time'
+MAX_LOAD_COLUMN = 'max_load'
+MEAN_LOAD = 'mean_load'
+MIN_PLAYER_COUNT = 'min_player_count'
+MAX_PLAYER_COUNT = 'max_player_count'
+PROFILE = 'profile'
+PEAK_RSS_BYTES = 'peak_rss_bytes'
+MAX_SERVER_LOAD = 100  # load of a server running at its capacity, above which an allocation is invalid
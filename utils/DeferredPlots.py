@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def init_plot_worker():
+    """Renders without a display in the background process"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_snapshot(snapshot, save_file, show_plot):
+    """Draws the map of a method snapshot and frees its figure"""
+    import matplotlib.pyplot as plt
+    snapshot.plot_map(save_file=save_file, show_plot=show_plot)
+    plt.close('all')
+
+
+class DeferredPlots:
+    """Map plots taken off the allocation runs: add only snapshots the allocation (the player servers), render draws
+    the maps once the runs are done, the saved ones on a background process so the caller goes on meanwhile. Maps to
+    show are drawn in this process, which owns the display."""
+
+    def __init__(self, background=True):
+        self.background = background
+        self.pending = []
+        self.executor = None
+        self.futures = []
+
+    def add(self, method, save_file=True, show_plot=False):
+        if save_file or show_plot:
+            self.pending.append((method.plot_snapshot(), save_file, show_plot))
+
+    def render(self):
+        """Starts rendering the pending maps"""
+        pending, self.pending = self.pending, []
+        for snapshot, save_file, show_plot in pending:
+            if self.background and not show_plot:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=1, initializer=init_plot_worker)
+                self.futures.append(self.executor.submit(render_snapshot, snapshot, save_file, False))
+            else:
+                render_snapshot(snapshot, save_file, show_plot)
+
+    def wait(self):
+        """Renders the pending maps and waits for the background ones"""
+        self.render()
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures.clear()
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
@@ -0,0 +1,218 @@
+import numpy as np
+from scipy import sparse
+
+from utils.NeighborGraph import expand_pairs, gather_pairs
+
+MATCHING_ROUNDS = 5
+MIN_COARSENING_RATIO = 0.95  # coarsening stops when a level keeps more than this share of the vertices
+
+
+def build_visibility_graph(neighbors, player_count):
+    """Builds the symmetric CSR adjacency of the visibility graph, weighting each edge by how many of its two
+    players see the other one"""
+    player_ids, neighbor_ids = expand_pairs(neighbors)
+    directed = sparse.csr_matrix((np.ones(len(player_ids), dtype=np.float32), (player_ids, neighbor_ids)),
+                                 shape=(player_count, player_count))
+    return (directed + directed.T).tocsr()
+
+
+def symmetric_noise(rows, cols, seed):
+    """Pseudo-random values in [0, 0.5) that are the same for both directions of an edge"""
+    low = np.minimum(rows, cols).astype(np.uint64)
+    high = np.maximum(rows, cols).astype(np.uint64)
+    hashed = low * np.uint64(0x9E3779B97F4A7C15) + high * np.uint64(0xC2B2AE3D27D4EB4F) + np.uint64(seed)
+    hashed ^= hashed >> np.uint64(29)
+    hashed *= np.uint64(0xBF58476D1CE4E5B9)
+    hashed ^= hashed >> np.uint64(32)
+    return (hashed >> np.uint64(11)).astype(np.float64) / 2.0 ** 54
+
+
+def row_maximum(rows, values):
+    """For rows sorted in ascending order, returns each row present and the position of its largest value"""
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.zeros(0, dtype=np.int64)
+    maximums = np.maximum.reduceat(values, starts) if len(rows) else values
+    is_maximum = values == np.repeat(maximums, np.diff(np.r_[starts, len(rows)]))
+    first_maximum = np.flatnonzero(is_maximum)
+    first_maximum = first_maximum[np.r_[True, rows[first_maximum][1:] != rows[first_maximum][:-1]]] \
+        if len(first_maximum) else first_maximum
+    return rows[first_maximum], first_maximum
+
+
+def heavy_edge_matching(adjacency, vertex_weights, max_vertex_weight, rng):
+    """Matches every vertex whose heaviest edge is also the heaviest edge of the neighbor at the other end (locally
+    dominant edges, ties broken by a random priority shared by both ends), over a few rounds, as long as the merged
+    weight stays under max_vertex_weight. Returns the coarse vertex of each vertex and the number of coarse vertices"""
+    vertex_count = adjacency.shape[0]
+    edges = adjacency.tocoo()  # rows come out sorted from the CSR matrix
+    match = np.full(vertex_count, -1, dtype=np.int64)
+    fits = vertex_weights[edges.row] + vertex_weights[edges.col] <= max_vertex_weight
+    rows, cols = edges.row[fits].astype(np.int64), edges.col[fits].astype(np.int64)
+    priorities = edges.data[fits] + symmetric_noise(rows, cols, rng.integers(2 ** 32))
+    for _ in range(MATCHING_ROUNDS):
+        free = (match[rows] < 0) & (match[cols] < 0)
+        rows, cols, priorities = rows[free], cols[free], priorities[free]
+        if len(rows) == 0:
+            break
+        best = np.full(vertex_count, -1, dtype=np.int64)
+        heaviest_rows, heaviest = row_maximum(rows, priorities)
+        best[heaviest_rows] = cols[heaviest]
+        mutual = heaviest_rows[best[best[heaviest_rows]] == heaviest_rows]
+        match[mutual] = best[mutual]
+    leaders = np.where(match < 0, np.arange(vertex_count), np.minimum(np.arange(vertex_count), match))
+    _, coarse_map = np.unique(leaders, return_inverse=True)
+    return coarse_map, int(coarse_map.max()) + 1 if vertex_count else 0
+
+
+def contract(adjacency, coarse_map, coarse_count):
+    """Merges matched vertices, summing the weights of the edges between the merged groups"""
+    projection = sparse.csr_matrix((np.ones(len(coarse_map), dtype=np.float32),
+                                    (np.arange(len(coarse_map)), coarse_map)),
+                                   shape=(len(coarse_map), coarse_count))
+    coarse_adjacency = (projection.T @ adjacency @ projection).tocsr()
+    coarse_adjacency.setdiag(0)
+    coarse_adjacency.eliminate_zeros()
+    return coarse_adjacency
+
+
+def weighted_bisection(positions, vertex_weights, vertex_ids, first_part, last_part, parts):
+    """Recursively splits weighted points across the longer side of their bounding box, giving each half a share of
+    the weight proportional to its share of the parts [first_part, last_part)"""
+    part_count = last_part - first_part
+    if part_count == 1 or len(vertex_ids) == 0:
+        parts[vertex_ids] = first_part
+        return
+    left_parts = part_count // 2
+    points = positions[vertex_ids]
+    axis = int(np.argmax(points.max(axis=0) - points.min(axis=0)))
+    order = np.argsort(points[:, axis], kind='stable')
+    cumulative_weights = np.cumsum(vertex_weights[vertex_ids[order]])
+    split_idx = int(np.searchsorted(cumulative_weights, cumulative_weights[-1] * left_parts / part_count))
+    weighted_bisection(positions, vertex_weights, vertex_ids[order[:split_idx]], first_part,
+                       first_part + left_parts, parts)
+    weighted_bisection(positions, vertex_weights, vertex_ids[order[split_idx:]], first_part + left_parts,
+                       last_part, parts)
+
+
+def refine_partition(adjacency, parts, vertex_weights, part_count, max_part_weight, passes, rng):
+    """Greedy Fiduccia-Mattheyses style refinement, vectorized over all boundary vertices: each pass moves a random
+    half of the vertices to the neighboring part they are most connected to when it cuts fewer edge weights (or when
+    their own part is over max_part_weight), best gains first, while the target part has room"""
+    vertex_count = adjacency.shape[0]
+    part_weights = np.bincount(parts, weights=vertex_weights, minlength=part_count)
+    idle_passes = 0
+    for _ in range(passes):
+        membership = sparse.csr_matrix((np.ones(vertex_count, dtype=np.float32), (np.arange(vertex_count), parts)),
+                                       shape=(vertex_count, part_count))
+        connectivity = (adjacency @ membership).tocoo()
+        rows, cols, data = connectivity.row, connectivity.col, connectivity.data
+        own = cols == parts[rows]
+        internal = np.zeros(vertex_count, dtype=np.float32)
+        internal[rows[own]] = data[own]
+        rows, cols, data = rows[~own], cols[~own], data[~own]
+        movers, strongest = row_maximum(rows, data + rng.random(len(data), dtype=np.float32) * 0.01)
+        targets = cols[strongest]
+        gains = data[strongest] - internal[movers]
+        overweight = part_weights[parts[movers]] > max_part_weight
+        active = ((gains > 0) | overweight) & (rng.random(len(movers)) < 0.5)
+        movers, targets, gains = movers[active], targets[active], gains[active]
+        order = np.lexsort((-gains, targets))
+        movers, targets = movers[order], targets[order]
+        group_starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]]) if len(targets) else targets
+        cumulative_weights = np.cumsum(vertex_weights[movers])
+        group_offsets = np.repeat(cumulative_weights[group_starts] - vertex_weights[movers[group_starts]],
+                                  np.diff(np.r_[group_starts, len(targets)]).astype(np.int64))
+        fits = cumulative_weights - group_offsets <= max_part_weight - part_weights[targets]
+        movers, targets = movers[fits], targets[fits]
+        if len(movers) == 0:
+            idle_passes += 1
+            if idle_passes >= 2:
+                break
+            continue
+        idle_passes = 0
+        np.subtract.at(part_weights, parts[movers], vertex_weights[movers])
+        np.add.at(part_weights, targets, vertex_weights[movers])
+        parts[movers] = targets
+    return parts
+
+
+def multilevel_partition(adjacency, positions, part_count, max_part_weight, rng, coarsest_size, refinement_passes):
+    """Multilevel graph partitioning: coarsens the graph by heavy-edge matching, splits the coarsest graph by weighted
+    spatial bisection, then projects the parts back level by level refining each one"""
+    vertex_weights = np.ones(adjacency.shape[0])
+    max_vertex_weight = max(1.0, 2 * adjacency.shape[0] / max(coarsest_size, 1))
+    levels = []
+    while adjacency.shape[0] > coarsest_size:
+        coarse_map, coarse_count = heavy_edge_matching(adjacency, vertex_weights, max_vertex_weight, rng)
+        if coarse_count > MIN_COARSENING_RATIO * adjacency.shape[0]:
+            break
+        levels.append((adjacency, vertex_weights, coarse_map))
+        coarse_weights = np.bincount(coarse_map, weights=vertex_weights, minlength=coarse_count)
+        positions = np.column_stack([
+            np.bincount(coarse_map, weights=positions[:, axis] * vertex_weights, minlength=coarse_count)
+            for axis in range(2)]) / coarse_weights[:, None]
+        adjacency = contract(adjacency, coarse_map, coarse_count)
+        vertex_weights = coarse_weights
+    parts = np.empty(adjacency.shape[0], dtype=np.int64)
+    weighted_bisection(positions, vertex_weights, np.arange(adjacency.shape[0]), 0, part_count, parts)
+    parts = refine_partition(adjacency, parts, vertex_weights, part_count, max_part_weight, refinement_passes, rng)
+    for adjacency, vertex_weights, coarse_map in reversed(levels):
+        parts = refine_partition(adjacency, parts[coarse_map], vertex_weights, part_count, max_part_weight,
+                                 refinement_passes, rng)
+    return parts
+
+
+def forward_references(neighbors, parts, part_count):
+    """Returns, for each part s and player j, how many players in part s see player j, and the number of forwards"""
+    player_count = len(parts)
+    player_ids, neighbor_ids = expand_pairs(neighbors)
+    keys = parts[player_ids].astype(np.int64) * player_count + neighbor_ids
+    references = np.bincount(keys, minlength=part_count * player_count).reshape(part_count, player_count)
+    forwards = np.count_nonzero((references > 0) & (parts[None, :] != np.arange(part_count)[:, None]))
+    return references, forwards
+
+
+def refine_forwards(neighbors, parts, part_count, max_part_weight, passes, rng):
+    """Refines a partition of the players for the number of forwards rather than the edge cut: each player is
+    forwarded once to every other part holding one of its viewers. Every pass scores the exact gain of moving each
+    boundary player alone to the part most of its neighbors are in and moves a random share of the improving players
+    while their target has room. A pass that does not lower the forwards is undone and the share is halved"""
+    player_ids, neighbor_ids = expand_pairs(neighbors)
+    references, forwards = forward_references(neighbors, parts, part_count)
+    active_share = 0.5
+    for _ in range(passes):
+        # only players seeing another part can lower the forwards by moving
+        sees_other_part = np.zeros(len(parts), dtype=bool)
+        sees_other_part[player_ids[parts[neighbor_ids] != parts[player_ids]]] = True
+        candidates = np.flatnonzero(sees_other_part)
+        candidate_count = len(candidates)
+        viewers, viewed = gather_pairs(neighbors, candidates)
+        viewed_parts = parts[viewed]
+        votes = np.bincount(viewers * part_count + viewed_parts,
+                            minlength=candidate_count * part_count).reshape(candidate_count, part_count)
+        sources = parts[candidates]
+        votes[np.arange(candidate_count), sources] = -1
+        targets = votes.argmax(axis=1)
+        # the player itself becomes foreign to its old part and local to the new one
+        delta = (references[sources, candidates] > 0).astype(np.int64) - (references[targets, candidates] > 0)
+        pair_sources, pair_targets = sources[viewers], targets[viewers]
+        lost = (references[pair_sources, viewed] == 1) & (viewed_parts != pair_sources)
+        gained = (references[pair_targets, viewed] == 0) & (viewed_parts != pair_targets)
+        delta += np.bincount(viewers, weights=gained.astype(np.int64) - lost,
+                             minlength=candidate_count).astype(np.int64)
+        movers = np.flatnonzero((delta < 0) & (rng.random(candidate_count) < active_share))
+        movers = movers[np.lexsort((delta[movers], targets[movers]))]
+        mover_targets = targets[movers]
+        rank_in_target = np.arange(len(movers)) - np.searchsorted(mover_targets, mover_targets)
+        room = max_part_weight - np.bincount(parts, minlength=part_count)
+        movers = movers[rank_in_target < room[mover_targets]]
+        if len(movers) == 0:
+            break
+        previous_parts = parts.copy()
+        parts[candidates[movers]] = targets[movers]
+        new_references, new_forwards = forward_references(neighbors, parts, part_count)
+        if new_forwards >= forwards:
+            parts[:] = previous_parts
+            active_share /= 2
+            continue
+        references, forwards = new_references, new_forwards
+    return parts
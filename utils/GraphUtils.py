@@ -13,6 +13,7 @@ def plot_forwards_x_tries(x, y, method: Method):
     plt.title("Forwards per number of Tries")
     filename = get_output_path("graphs",
                                f"fwds_x_tries_{method.method_name}_{method.player_count}players_{method.server_count}servers_{method.viewable_players}neighbors_{method.server_capacity}cap")
+    filename.parent.mkdir(parents=True, exist_ok=True)
     plt.savefig(filename)
     plt.show()
 
@@ -27,5 +28,6 @@ def plot_methods_time(*methods: Method):
     plt.title("Time elapsed per method")
     plt.ylabel("Time elapsed (s)")
     plt.bar(labels, method_times)
+    filename.parent.mkdir(parents=True, exist_ok=True)
     plt.savefig(filename)
     plt.show()
@@ -0,0 +1,125 @@
+import numpy as np
+
+from utils.Constants import TOTAL_FWDS, FWDS_BY_SERVER, LOAD, INVALID, PLAYER_COUNT, MAX_SERVER_LOAD
+from utils.ServerUtils import neighbor_pairs
+
+REPLACE_CHUNK_SIZE = 1 << 15
+# replacing a list costs about as much as seven players of a fresh evaluator, past this share of players with new
+# neighbors the evaluator is rebuilt instead
+REPLACE_SHARE = 0.1
+
+
+class IncrementalEvaluator:
+    """Keeps forwards and loads of an allocation up to date while players move between servers.
+
+    For each server it keeps a reference count of how many of its players see each player, so moving a
+    player only touches its own neighbors and its own column: O(k) per move instead of a full
+    publish_interest_groups. Moves are applied in place to the players server array, and the evaluator keeps its own
+    copy of the assignment to tell whether it still tracks the players."""
+
+    def __init__(self, players, server_count, load_factor_own_cost, load_factor_forward_cost):
+        self.players = players
+        self.server_count = server_count
+        self.load_factor_own_cost = load_factor_own_cost
+        self.load_factor_forward_cost = load_factor_forward_cost
+        self.history = []
+        player_count = len(players)
+        player_ids, neighbor_ids = neighbor_pairs(players)
+        keys = players.server[player_ids].astype(np.int64) * player_count + neighbor_ids
+        self.references = np.bincount(keys, minlength=server_count * player_count) \
+            .astype(np.int32).reshape(server_count, player_count)
+        foreign = players.server[None, :] != np.arange(server_count)[:, None]
+        self.forwards = np.count_nonzero((self.references > 0) & foreign, axis=1)
+        self.player_counts = players.player_counts(server_count)
+        self.servers = players.server.copy()
+
+    @property
+    def total_forwards(self):
+        return int(self.forwards.sum())
+
+    @property
+    def loads(self):
+        return self.player_counts * self.load_factor_own_cost + self.forwards * self.load_factor_forward_cost
+
+    def evaluation(self):
+        """Returns the current evaluation with the same keys as ServerUtils.evaluate_allocation"""
+        loads = self.loads
+        return {
+            TOTAL_FWDS: self.total_forwards,
+            FWDS_BY_SERVER: self.forwards.tolist(),
+            LOAD: loads.tolist(),
+            INVALID: bool((loads > MAX_SERVER_LOAD).any()),
+            PLAYER_COUNT: self.player_counts.tolist()
+        }
+
+    def tracks(self, assignment):
+        """Whether the evaluator state is the one of the given assignment"""
+        return np.array_equal(self.servers, assignment)
+
+    def replace_neighbors(self, player_ids, old_neighbors):
+        """Updates the reference counts and forwards after the neighbors of the given dense-list players changed from
+        the rows of old_neighbors to their current ones, O(k^2) per player"""
+        player_count = len(self.players)
+        removed_keys, added_keys = [], []
+        for first in range(0, len(player_ids), REPLACE_CHUNK_SIZE):
+            chunk_ids = player_ids[first:first + REPLACE_CHUNK_SIZE]
+            old_rows = old_neighbors[first:first + REPLACE_CHUNK_SIZE]
+            new_rows = self.players.neighbors[chunk_ids]
+            # most neighbors survive a search, only the ones in a single list change the counts
+            same = old_rows[:, :, None] == new_rows[:, None, :]
+            row_keys = self.servers[chunk_ids].astype(np.int64)[:, None] * player_count
+            removed_keys.append((row_keys + old_rows)[~same.any(axis=2)])
+            added_keys.append((row_keys + new_rows)[~same.any(axis=1)])
+        removed_keys = np.concatenate(removed_keys) if removed_keys else np.zeros(0, dtype=np.int64)
+        added_keys = np.concatenate(added_keys) if added_keys else np.zeros(0, dtype=np.int64)
+        references = self.references.reshape(-1)
+        touched = np.unique(np.concatenate([removed_keys, added_keys]))
+        seen_before = references[touched] > 0
+        np.subtract.at(references, removed_keys, 1)
+        np.add.at(references, added_keys, 1)
+        seen_change = (references[touched] > 0).astype(np.int64) - seen_before
+        touched_servers, touched_players = np.divmod(touched, player_count)
+        foreign = self.servers[touched_players] != touched_servers
+        self.forwards += np.bincount(touched_servers[foreign], weights=seen_change[foreign],
+                                     minlength=self.server_count).astype(self.forwards.dtype)
+
+    def _apply_move(self, player_id, target):
+        """Moves a player to the target server, returning the variation in total forwards"""
+        servers = self.players.server
+        source = int(servers[player_id])
+        if source == target:
+            return 0
+        neighbors = self.players.neighbors[player_id]
+        neighbor_servers = servers[neighbors]
+        forwards_before = self.forwards[source] + self.forwards[target]
+        self.references[source, neighbors] -= 1
+        self.forwards[source] -= np.count_nonzero((self.references[source, neighbors] == 0) &
+                                                  (neighbor_servers != source))
+        self.references[target, neighbors] += 1
+        self.forwards[target] += np.count_nonzero((self.references[target, neighbors] == 1) &
+                                                  (neighbor_servers != target))
+        # the player itself becomes foreign to its old server and local to the new one
+        self.forwards[source] += self.references[source, player_id] > 0
+        self.forwards[target] -= self.references[target, player_id] > 0
+        servers[player_id] = target
+        self.servers[player_id] = target
+        self.player_counts[source] -= 1
+        self.player_counts[target] += 1
+        return int(self.forwards[source] + self.forwards[target] - forwards_before)
+
+    def move(self, player_id, target):
+        """Moves a player to the target server, returning the variation in total forwards"""
+        self.history.append((player_id, int(self.players.server[player_id])))
+        return self._apply_move(player_id, target)
+
+    def undo(self):
+        """Reverts the last move, returning the variation in total forwards"""
+        player_id, source = self.history.pop()
+        return self._apply_move(player_id, source)
+
+    def score_delta(self, player_id, target):
+        """Returns the variation in total forwards and the resulting loads of moving a player, without moving it"""
+        forwards_delta = self.move(player_id, target)
+        loads = self.loads
+        self.undo()
+        return forwards_delta, loads
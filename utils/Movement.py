@@ -0,0 +1,72 @@
+import numpy as np
+
+RANDOM_WALK = 'random_walk'
+RANDOM_WAYPOINT = 'random_waypoint'
+
+
+def reflect_positions(positions, map_size_x, map_size_y):
+    """Reflects positions that left the map back inside it"""
+    map_size = np.array([map_size_x, map_size_y], dtype=np.float64)
+    positions = np.abs(positions)
+    return np.where(positions > map_size, 2 * map_size - positions, positions).clip(0, map_size)
+
+
+class RandomWalk:
+    """Each tick a share of the players takes a gaussian step of the given mean length in a random direction"""
+
+    def __init__(self, map_size_x, map_size_y, speed=5.0, moving_share=0.1):
+        self.map_size_x = map_size_x
+        self.map_size_y = map_size_y
+        self.speed = speed
+        self.moving_share = moving_share
+
+    def move(self, players):
+        """Moves the players in place, returning the ids of the moved players and their previous positions"""
+        moved_ids = np.flatnonzero(np.random.random(len(players)) < self.moving_share)
+        old_positions = players.positions[moved_ids]
+        steps = np.random.normal(0, self.speed / np.sqrt(2), (len(moved_ids), 2))
+        players.positions[moved_ids] = reflect_positions(old_positions + steps, self.map_size_x, self.map_size_y)
+        return moved_ids, old_positions
+
+
+class RandomWaypoint:
+    """Each tick a share of the players walks towards its own waypoint at the given speed, drawing a new waypoint
+    on the map once it gets there"""
+
+    def __init__(self, map_size_x, map_size_y, speed=5.0, moving_share=0.1):
+        self.map_size_x = map_size_x
+        self.map_size_y = map_size_y
+        self.speed = speed
+        self.moving_share = moving_share
+        self.waypoints = None
+
+    def draw_waypoints(self, count):
+        """Returns uniformly random positions on the map"""
+        return np.random.random((count, 2)) * np.array([self.map_size_x, self.map_size_y])
+
+    def move(self, players):
+        """Moves the players in place, returning the ids of the moved players and their previous positions"""
+        if self.waypoints is None or len(self.waypoints) != len(players):
+            self.waypoints = self.draw_waypoints(len(players))
+        moved_ids = np.flatnonzero(np.random.random(len(players)) < self.moving_share)
+        old_positions = players.positions[moved_ids]
+        directions = self.waypoints[moved_ids] - old_positions
+        distances = np.linalg.norm(directions, axis=1)
+        arrived = distances <= self.speed
+        steps = directions * (self.speed / np.maximum(distances, np.finfo(np.float64).eps))[:, None]
+        players.positions[moved_ids] = np.where(arrived[:, None], self.waypoints[moved_ids], old_positions + steps)
+        self.waypoints[moved_ids[arrived]] = self.draw_waypoints(int(arrived.sum()))
+        return moved_ids, old_positions
+
+
+MOVEMENT_MODELS = {
+    RANDOM_WALK: RandomWalk,
+    RANDOM_WAYPOINT: RandomWaypoint
+}
+
+
+def generate_movement_model(model, map_size_x, map_size_y, speed=5.0, moving_share=0.1):
+    """Builds a movement model moving players on the map"""
+    if model not in MOVEMENT_MODELS:
+        raise ValueError(f"Unknown movement model '{model}', expected one of {list(MOVEMENT_MODELS)}")
+    return MOVEMENT_MODELS[model](map_size_x, map_size_y, speed, moving_share)
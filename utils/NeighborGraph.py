@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class CsrNeighbors:
+    """Variable-length viewable players in compressed sparse row form, as built by the radius visibility model: the
+    neighbors of player i are indices[indptr[i]:indptr[i + 1]]. Indexing a player returns its neighbors like a row
+    of the dense (N, k) matrix of the fixed-k model"""
+
+    def __init__(self, indptr, indices):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+
+    @classmethod
+    def from_pairs(cls, player_ids, neighbor_ids, player_count):
+        """Builds the neighbors from unordered (player, neighbor) pairs, sorting each row by neighbor id"""
+        keys = np.asarray(player_ids, dtype=np.int64) * player_count + neighbor_ids
+        keys.sort()  # one sort of the packed keys, far cheaper than a lexsort of both arrays
+        indptr = np.zeros(player_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(player_ids, minlength=player_count), out=indptr[1:])
+        return cls(indptr, keys % max(player_count, 1))
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, player_id):
+        return self.indices[self.indptr[player_id]:self.indptr[player_id + 1]]
+
+    @property
+    def degrees(self):
+        """Number of neighbors of each player"""
+        return np.diff(self.indptr)
+
+    def copy(self):
+        return CsrNeighbors(self.indptr.copy(), self.indices.copy())
+
+
+def expand_pairs(neighbors, first=0, last=None):
+    """Returns the (player, neighbor) pairs of the players first to last as two flat arrays, from a dense neighbor
+    matrix or CSR neighbors"""
+    if isinstance(neighbors, CsrNeighbors):
+        last = len(neighbors) if last is None else min(last, len(neighbors))
+        counts = np.diff(neighbors.indptr[first:last + 1])
+        return np.repeat(np.arange(first, last), counts), \
+            np.asarray(neighbors.indices[neighbors.indptr[first]:neighbors.indptr[last]])
+    rows = np.asarray(neighbors[first:last])
+    return np.repeat(np.arange(first, first + len(rows)), rows.shape[1]), rows.ravel()
+
+
+def gather_pairs(neighbors, player_ids):
+    """Returns the neighbors of the given players as two flat arrays: the position of each player in player_ids,
+    once per neighbor, and the neighbor ids"""
+    if isinstance(neighbors, CsrNeighbors):
+        starts = neighbors.indptr[player_ids]
+        counts = neighbors.indptr[np.asarray(player_ids) + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(np.arange(len(counts)), counts), neighbors.indices[np.repeat(starts, counts) + offsets]
+    rows = neighbors[player_ids]
+    return np.repeat(np.arange(len(rows)), rows.shape[1]), rows.ravel()
@@ -0,0 +1,348 @@
+import numpy as np
+
+from utils.NeighborGraph import CsrNeighbors
+from utils.SpatialIndex import generate_spatial_index, find_k_nearest, add_to_spatial_index, \
+    remove_from_spatial_index
+
+KDTREE_BACKEND = 'kdtree'
+GRID_BACKEND = 'grid'
+RTREE_BACKEND = 'rtree'
+REBUILD_SHARE = 0.05  # share of players moved since the KD-tree was built above which it is rebuilt
+FULL_SEARCH_SHARE = 0.5  # share of moved players above which every neighbor list is searched again
+
+
+def clamp_neighbor_count(k, player_count):
+    """Number of viewable players each player can have: k, or every other player when there are no more than k"""
+    return min(k, max(player_count - 1, 0))
+
+
+def check_neighbor_count(k, player_count):
+    """Raises a ValueError when players cannot have k neighbors each (see clamp_neighbor_count)"""
+    if k >= player_count:
+        raise ValueError(f"Cannot find {k} neighbors per player among {player_count} players")
+
+
+def exclude_self(candidates, query_ids, k):
+    """Drops each query's own id from its (ordered) k + 1 nearest candidates, keeping exactly k neighbors.
+    When the query is not among its candidates (coinciding positions) the farthest candidate is dropped instead"""
+    is_self = candidates == query_ids[:, None]
+    missing_self = ~is_self.any(axis=1)
+    is_self[missing_self, -1] = True
+    is_self[np.cumsum(is_self, axis=1) > 1] = False  # duplicated ids only drop once
+    return candidates[~is_self].reshape(len(candidates), k).astype(np.int32)
+
+
+def players_in_radius(tree, radius):
+    """Returns the CSR neighbors holding, for each player of a KD-tree, every other player within radius of it,
+    found by a single batched pair query over the tree"""
+    if radius <= 0:
+        raise ValueError(f"The visibility radius must be positive, got {radius}")
+    pairs = tree.query_pairs(radius, output_type='ndarray')
+    return CsrNeighbors.from_pairs(np.concatenate([pairs[:, 0], pairs[:, 1]]),
+                                   np.concatenate([pairs[:, 1], pairs[:, 0]]), tree.n)
+
+
+def positions_in_radius(positions, radius):
+    """players_in_radius over a KD-tree built for the query, for the backends without one: range queries are batched
+    over the tree rather than made player by player over their own index"""
+    from scipy.spatial import cKDTree
+    return players_in_radius(cKDTree(positions), radius)
+
+
+class KDTreeBackend:
+    """Batched all-points kNN queries on a KD-tree.
+
+    KD-trees cannot be updated in place: players moved since the tree was built are left out of it and searched in
+    a small tree of their own, rebuilt on each update, and the main tree is only rebuilt once they are more than
+    REBUILD_SHARE of the players"""
+
+    def __init__(self, players):
+        self.players = players
+        self.build()
+
+    def build(self):
+        """Builds the tree over the current positions, copied so later moves do not reach it"""
+        from scipy.spatial import cKDTree
+        self.tree = cKDTree(self.players.positions, copy_data=True)
+        self.displaced = np.zeros(len(self.players), dtype=bool)
+        self.displaced_ids = np.empty(0, dtype=np.int64)
+        self.displaced_tree = None
+
+    def find_k_nearest_players(self, k, player_ids=None):
+        """Returns the (N, k) matrix with the k nearest players of each player, excluding itself"""
+        check_neighbor_count(k, len(self.players))
+        player_ids = self.players.ids if player_ids is None else np.asarray(player_ids)
+        positions = self.players.positions[player_ids]
+        if self.displaced_tree is None:
+            _, candidates = self.tree.query(positions, k + 1, workers=-1)
+            return exclude_self(candidates.reshape(len(player_ids), k + 1), player_ids, k)
+        distances, candidates = self.query_in_place(positions, k + 1)
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :k + 1]
+        distances = np.take_along_axis(distances, nearest, axis=1)
+        candidates = np.take_along_axis(candidates, nearest, axis=1)
+        # only the few positions with moved players closer than their (k + 1)-th in-place player are merged
+        closer_counts = self.displaced_tree.query_ball_point(positions, distances[:, -1], return_length=True,
+                                                             workers=-1)
+        rows = np.flatnonzero(closer_counts > 0)
+        if len(rows) > 0:
+            closer_count = int(closer_counts.max())
+            moved_distances, moved = self.displaced_tree.query(positions[rows], closer_count, workers=-1)
+            merged_distances = np.hstack([distances[rows], moved_distances.reshape(len(rows), closer_count)])
+            merged = np.hstack([candidates[rows], self.displaced_ids[moved.reshape(len(rows), closer_count)]])
+            nearest = np.argsort(merged_distances, axis=1, kind='stable')[:, :k + 1]
+            candidates[rows] = np.take_along_axis(merged, nearest, axis=1)
+        return exclude_self(candidates, player_ids, k)
+
+    def query_in_place(self, positions, count):
+        """Returns the distances and ids of at least the count nearest players of each position among the players
+        that did not move since the tree was built, moved players being at an infinite distance. Positions that met
+        too many moved players are searched again with twice the candidates"""
+        player_count = len(self.players)
+        width = min(count + int(np.ceil(2 * count * len(self.displaced_ids) / player_count)) + 1, player_count)
+        distances, candidates = self.tree.query(positions, width, workers=-1)
+        distances = distances.reshape(len(positions), width)
+        candidates = candidates.reshape(len(positions), width)
+        distances[self.displaced[candidates]] = np.inf
+        rows = np.flatnonzero(np.isfinite(distances).sum(axis=1) < count) if width < player_count else []
+        candidate_count = width
+        while len(rows) > 0:
+            candidate_count = min(candidate_count * 2, player_count)
+            found_distances, found = self.tree.query(positions[rows], candidate_count, workers=-1)
+            found_distances[self.displaced[found]] = np.inf
+            nearest = np.argsort(found_distances, axis=1, kind='stable')[:, :width]
+            distances[rows] = np.take_along_axis(found_distances, nearest, axis=1)
+            candidates[rows] = np.take_along_axis(found, nearest, axis=1)
+            if candidate_count == player_count:
+                break
+            rows = rows[np.isfinite(distances[rows]).sum(axis=1) < count]
+        return distances, candidates
+
+    def find_players_in_radius(self, radius):
+        """Returns the CSR neighbors with every other player within radius of each player"""
+        if self.displaced_tree is not None:
+            self.build()
+        return players_in_radius(self.tree, radius)
+
+    def update_players(self, player_ids, old_positions):
+        """Moves players out of the tree into the tree of moved players, rebuilding the main tree over the new
+        positions once too many players moved"""
+        from scipy.spatial import cKDTree
+        self.displaced[player_ids] = True
+        self.displaced_ids = np.flatnonzero(self.displaced)
+        if len(self.displaced_ids) > REBUILD_SHARE * len(self.players):
+            self.build()
+        elif len(self.displaced_ids) > 0:
+            self.displaced_tree = cKDTree(self.players.positions[self.displaced_ids])
+
+
+class GridBackend:
+    """Batched kNN queries on a uniform grid of buckets, searching growing rings of cells around each bucket"""
+
+    def __init__(self, players, players_per_cell=16):
+        self.players = players
+        positions = players.positions
+        self.origin = positions.min(axis=0)
+        extent = np.maximum(positions.max(axis=0) - self.origin, np.finfo(np.float64).eps)
+        self.cell_size = max(np.sqrt(extent[0] * extent[1] * players_per_cell / max(len(players), 1)),
+                             extent.max() / 4096)
+        self.cells_x, self.cells_y = (np.floor(extent / self.cell_size).astype(np.int64) + 1).tolist()
+        cell_x, cell_y = self.cell_coordinates(positions)
+        self.cell_keys = cell_y * self.cells_x + cell_x
+        self.order = np.argsort(self.cell_keys, kind='stable')
+        self.cell_start = np.searchsorted(self.cell_keys[self.order], np.arange(self.cells_x * self.cells_y + 1))
+
+    def cell_coordinates(self, positions):
+        """Returns the grid cell of each position"""
+        cells = np.floor((positions - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(cells[:, 0], 0, self.cells_x - 1), np.clip(cells[:, 1], 0, self.cells_y - 1)
+
+    def ring_candidates(self, cell_x, cell_y, radius):
+        """Returns the players inside the square of cells within radius of a cell"""
+        x_min, x_max = max(cell_x - radius, 0), min(cell_x + radius, self.cells_x - 1)
+        rows = range(max(cell_y - radius, 0), min(cell_y + radius, self.cells_y - 1) + 1)
+        return np.concatenate([self.order[self.cell_start[row * self.cells_x + x_min]:
+                                          self.cell_start[row * self.cells_x + x_max + 1]] for row in rows])
+
+    def safe_distance(self, positions, cell_x, cell_y, radius):
+        """Distance from each position to the border of the searched square (infinite at the grid borders)"""
+        low = self.origin + np.array([cell_x - radius, cell_y - radius]) * self.cell_size
+        high = self.origin + np.array([cell_x + radius + 1, cell_y + radius + 1]) * self.cell_size
+        margins = np.hstack([positions - low, high - positions])
+        margins[:, 0] = np.inf if cell_x - radius <= 0 else margins[:, 0]
+        margins[:, 1] = np.inf if cell_y - radius <= 0 else margins[:, 1]
+        margins[:, 2] = np.inf if cell_x + radius >= self.cells_x - 1 else margins[:, 2]
+        margins[:, 3] = np.inf if cell_y + radius >= self.cells_y - 1 else margins[:, 3]
+        return margins.min(axis=1)
+
+    def find_k_nearest_players(self, k, player_ids=None):
+        """Returns the (N, k) matrix with the k nearest players of each player, excluding itself"""
+        check_neighbor_count(k, len(self.players))
+        positions = self.players.positions
+        player_ids = self.players.ids if player_ids is None else np.asarray(player_ids)
+        neighbors = np.empty((len(player_ids), k), dtype=np.int32)
+        cell_x, cell_y = self.cell_coordinates(positions[player_ids])
+        query_order = np.lexsort((cell_x, cell_y))
+        cell_keys = (cell_y * self.cells_x + cell_x)[query_order]
+        bucket_bounds = np.flatnonzero(np.diff(cell_keys)) + 1
+        for bucket in np.split(query_order, bucket_bounds):
+            bucket_cell_x, bucket_cell_y = int(cell_x[bucket[0]]), int(cell_y[bucket[0]])
+            radius = 1
+            while len(bucket) > 0:
+                candidates = self.ring_candidates(bucket_cell_x, bucket_cell_y, radius)
+                # once the ring covers the whole grid it holds every player, more than k after the check above
+                if len(candidates) <= k and radius < max(self.cells_x, self.cells_y):
+                    radius += 1
+                    continue
+                query_positions = positions[player_ids[bucket]]
+                distances = ((query_positions[:, None, :] - positions[candidates][None, :, :]) ** 2).sum(axis=2)
+                nearest = np.argpartition(distances, k, axis=1)[:, :k + 1]
+                nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+                sorting = np.argsort(nearest_distances, axis=1, kind='stable')
+                nearest = np.take_along_axis(nearest, sorting, axis=1)
+                nearest_distances = np.take_along_axis(nearest_distances, sorting, axis=1)
+                safe = np.sqrt(nearest_distances[:, -1]) <= self.safe_distance(query_positions, bucket_cell_x,
+                                                                               bucket_cell_y, radius)
+                neighbors[bucket[safe]] = exclude_self(candidates[nearest[safe]], player_ids[bucket[safe]], k)
+                bucket = bucket[~safe]
+                radius += 1
+        return neighbors
+
+    def find_players_in_radius(self, radius):
+        """Returns the CSR neighbors with every other player within radius of each player"""
+        return positions_in_radius(self.players.positions, radius)
+
+    def update_players(self, player_ids, old_positions):
+        """Moves players to their new buckets without sorting the grid again: the players that changed cell are
+        taken out of the bucket order and inserted back at the end of their new cell"""
+        player_ids = np.asarray(player_ids, dtype=np.int64)
+        cell_x, cell_y = self.cell_coordinates(self.players.positions[player_ids])
+        new_keys = cell_y * self.cells_x + cell_x
+        changed = new_keys != self.cell_keys[player_ids]
+        player_ids, new_keys = player_ids[changed], new_keys[changed]
+        if len(player_ids) == 0:
+            return
+        cell_count = self.cells_x * self.cells_y
+        slots = np.empty(len(self.order), dtype=np.int64)
+        slots[self.order] = np.arange(len(self.order))
+        kept = np.ones(len(self.order), dtype=bool)
+        kept[slots[player_ids]] = False
+        removed_per_cell = np.bincount(self.cell_keys[player_ids], minlength=cell_count)
+        cell_start = self.cell_start - np.r_[0, np.cumsum(removed_per_cell)]
+        insertion_order = np.argsort(new_keys, kind='stable')
+        player_ids, new_keys = player_ids[insertion_order], new_keys[insertion_order]
+        self.order = np.insert(self.order[kept], cell_start[new_keys + 1], player_ids)
+        self.cell_start = cell_start + np.r_[0, np.cumsum(np.bincount(new_keys, minlength=cell_count))]
+        self.cell_keys[player_ids] = new_keys
+
+
+class RtreeBackend:
+    """Reference backend making one rtree nearest query per player"""
+
+    def __init__(self, players):
+        self.players = players
+        self.spatial_index = generate_spatial_index(players)
+
+    def find_k_nearest_players(self, k, player_ids=None):
+        """Returns the (N, k) matrix with the k nearest players of each player, excluding itself"""
+        check_neighbor_count(k, len(self.players))
+        player_ids = self.players.ids if player_ids is None else np.asarray(player_ids)
+        candidates = np.empty((len(player_ids), k + 1), dtype=np.int64)
+        for row, player_id in enumerate(player_ids.tolist()):
+            x, y = self.players.positions[player_id].tolist()
+            nearest = find_k_nearest(self.spatial_index, x, y, k)
+            if player_id in nearest[k + 1:]:  # ties past k + 1 may still hold the player itself
+                nearest[k] = player_id
+            candidates[row] = nearest[:k + 1]
+        return exclude_self(candidates, player_ids, k)
+
+    def find_players_in_radius(self, radius):
+        """Returns the CSR neighbors with every other player within radius of each player"""
+        return positions_in_radius(self.players.positions, radius)
+
+    def update_players(self, player_ids, old_positions):
+        """Deletes the moved players from the rtree and inserts them at their new positions"""
+        for player_id, (old_x, old_y) in zip(np.asarray(player_ids).tolist(), np.asarray(old_positions).tolist()):
+            x, y = self.players.positions[player_id].tolist()
+            remove_from_spatial_index(self.spatial_index, player_id, old_x, old_y)
+            add_to_spatial_index(self.spatial_index, player_id, x, y)
+
+
+NEIGHBOR_BACKENDS = {
+    KDTREE_BACKEND: KDTreeBackend,
+    GRID_BACKEND: GridBackend,
+    RTREE_BACKEND: RtreeBackend
+}
+
+
+def generate_neighbor_backend(players, backend=KDTREE_BACKEND):
+    """Builds the neighbor search backend over the players positions"""
+    if backend not in NEIGHBOR_BACKENDS:
+        raise ValueError(f"Unknown neighbor backend '{backend}', expected one of {list(NEIGHBOR_BACKENDS)}")
+    return NEIGHBOR_BACKENDS[backend](players)
+
+
+class IncrementalNeighbors:
+    """Keeps the viewable players up to date while players move, searching again only the lists a move may change.
+
+    For each player it keeps the distance to its farthest neighbor and a lower bound on the distance to every other
+    player, the (k + 1)-th distance of its last search. The list of a player that did not move stays exact while its
+    neighbors remain within that bound and no other moved player came inside it"""
+
+    def __init__(self, players, neighbor_backend, k):
+        self.players = players
+        self.neighbor_backend = neighbor_backend
+        self.k = clamp_neighbor_count(k, len(players))
+        self.kth_distances = np.zeros(len(players))
+        self.outside_distances = np.zeros(len(players))
+        self.search(players.ids)
+
+    def search(self, player_ids):
+        """Searches the k nearest players of the given players from scratch, with their distance bounds"""
+        # when every other player is a neighbor there is no player outside the lists
+        search_count = clamp_neighbor_count(self.k + 1, len(self.players))
+        nearest = self.neighbor_backend.find_k_nearest_players(search_count, player_ids)
+        self.players.neighbors[player_ids] = nearest[:, :self.k]
+        positions = self.players.positions
+        distances = np.linalg.norm(positions[player_ids, None, :] - positions[nearest[:, self.k - 1:]], axis=2)
+        self.kth_distances[player_ids] = distances[:, 0]
+        self.outside_distances[player_ids] = distances[:, 1] if search_count > self.k else np.inf
+
+    def update(self, moved_ids, old_positions):
+        """Updates the neighbor backend and the viewable players after moved_ids moved, returning the players whose
+        neighbors were searched again"""
+        self.neighbor_backend.update_players(moved_ids, old_positions)
+        players, positions = self.players, self.players.positions
+        if len(moved_ids) > FULL_SEARCH_SHARE * len(players):
+            self.search(players.ids)
+            return players.ids
+        moved = np.zeros(len(players), dtype=bool)
+        moved[moved_ids] = True
+        outdated = moved.copy()
+        if len(moved_ids) > 0:
+            from scipy.spatial import cKDTree
+            moved_tree = cKDTree(positions[moved_ids])
+            moved_neighbors = moved[players.neighbors]
+            # players none of whose neighbors moved only change if a moved player got closer than the k-th neighbor
+            quiet = np.flatnonzero(~moved & ~moved_neighbors.any(axis=1))
+            if len(quiet) > 0:
+                search_radius = np.nextafter(self.outside_distances[quiet].max(), np.inf)
+                distances, _ = moved_tree.query(positions[quiet], distance_upper_bound=search_radius, workers=-1)
+                outdated[quiet[distances <= self.kth_distances[quiet]]] = True
+                closer = (distances > self.kth_distances[quiet]) & (distances < self.outside_distances[quiet])
+                self.outside_distances[quiet[closer]] = distances[closer]
+            # players with moved neighbors keep them while they stay closer than any other player
+            shaken = np.flatnonzero(~moved & moved_neighbors.any(axis=1))
+            if len(shaken) > 0:
+                neighbor_distances = np.linalg.norm(positions[shaken, None, :] - positions[players.neighbors[shaken]],
+                                                    axis=2)
+                kth_distances = neighbor_distances.max(axis=1)
+                moved_inside = moved_tree.query_ball_point(positions[shaken], self.outside_distances[shaken],
+                                                           return_length=True, workers=-1)
+                kept = (kth_distances <= self.outside_distances[shaken]) & \
+                    (moved_inside == moved_neighbors[shaken].sum(axis=1))
+                self.kth_distances[shaken[kept]] = kth_distances[kept]
+                outdated[shaken[~kept]] = True
+        outdated_ids = np.flatnonzero(outdated)
+        if len(outdated_ids) > 0:
+            self.search(outdated_ids)
+        return outdated_ids
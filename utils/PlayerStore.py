@@ -0,0 +1,104 @@
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from utils.Constants import POS_X, POS_Y, ID, SERVER, NEIGHBORS
+
+UNALLOCATED = -1
+
+
+class PlayerStore:
+    """Structure-of-arrays player table (positions, server allocations and neighbor matrix)"""
+
+    def __init__(self, positions, ids=None, server=None, neighbors=None):
+        self.positions = np.ascontiguousarray(positions, dtype=np.float64)
+        player_count = len(self.positions)
+        self.ids = np.arange(player_count, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        if server is None:
+            server = np.full(player_count, UNALLOCATED, dtype=np.int32)
+        self.server = np.asarray(server, dtype=np.int32)
+        self.neighbors = neighbors
+
+    @property
+    def pos_x(self):
+        return self.positions[:, 0]
+
+    @property
+    def pos_y(self):
+        return self.positions[:, 1]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, player_id):
+        if not -len(self) <= player_id < len(self):
+            raise IndexError(f"Player {player_id} out of range")
+        return PlayerView(self, player_id % len(self))
+
+    def __iter__(self):
+        for player_id in range(len(self)):
+            yield PlayerView(self, player_id)
+
+    def player_counts(self, server_count):
+        """Returns the number of players allocated in each server"""
+        allocated = self.server[self.server != UNALLOCATED]
+        return np.bincount(allocated, minlength=server_count)
+
+    def clear_allocations(self):
+        """Marks every player as unallocated"""
+        self.server.fill(UNALLOCATED)
+
+
+class PlayerView(MutableMapping):
+    """Dict-style view of a single player row, kept for plotting and old callers"""
+
+    def __init__(self, store, player_id):
+        self._store = store
+        self._player_id = player_id
+
+    def _keys(self):
+        keys = [POS_X, POS_Y, ID]
+        if self._store.server[self._player_id] != UNALLOCATED:
+            keys.append(SERVER)
+        if self._store.neighbors is not None:
+            keys.append(NEIGHBORS)
+        return keys
+
+    def __getitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        if key == POS_X:
+            return self._store.positions[self._player_id, 0]
+        if key == POS_Y:
+            return self._store.positions[self._player_id, 1]
+        if key == ID:
+            return int(self._store.ids[self._player_id])
+        if key == SERVER:
+            return int(self._store.server[self._player_id])
+        return self._store.neighbors[self._player_id]
+
+    def __setitem__(self, key, value):
+        if key == POS_X:
+            self._store.positions[self._player_id, 0] = value
+        elif key == POS_Y:
+            self._store.positions[self._player_id, 1] = value
+        elif key == SERVER:
+            self._store.server[self._player_id] = value
+        elif key == NEIGHBORS:
+            self._store.neighbors[self._player_id] = value
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        if key != SERVER or self._store.server[self._player_id] == UNALLOCATED:
+            raise KeyError(key)
+        self._store.server[self._player_id] = UNALLOCATED
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,153 @@
+import cProfile
+import json
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from time import perf_counter_ns
+
+from utils.Constants import PEAK_RSS_BYTES
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the peak resident memory is then left out
+    resource = None
+
+PLAYER_GENERATION_PHASE = 'player_generation'
+INDEX_BUILD_PHASE = 'index_build'
+KNN_PHASE = 'knn'
+ASSIGNMENT_PHASE = 'assignment'
+PUBLISH_PHASE = 'interest_group_publish'
+LOAD_PHASE = 'load_calculation'
+OUTPUT_PHASE = 'output'
+PHASES = (PLAYER_GENERATION_PHASE, INDEX_BUILD_PHASE, KNN_PHASE, ASSIGNMENT_PHASE, PUBLISH_PHASE, LOAD_PHASE,
+          OUTPUT_PHASE)
+PHASE_COLUMNS = tuple(f"{name}_seconds" for name in PHASES)
+PROFILE_TOP_FUNCTIONS = 30
+
+active_profiler = None  # the profiler phase() charges, set while a method runs
+
+
+class PhaseProfiler:
+    """Wall time of each phase of a method measured with perf_counter_ns. Phases nest and are exclusive: time spent
+    in an inner phase (publishing interest groups inside an allocation) is not charged to the outer one, so the
+    phases add up to the profiled time.
+
+    Optional hooks: trace_memory records the peak traced Python memory of each phase with tracemalloc, cprofile
+    records a cProfile of everything run while the profiler is active. The tracemalloc peak is only reset between
+    phases when the profiler started tracing itself: under an outer tracemalloc measurement it is left alone and the
+    peak of a phase is the outer peak so far, an upper bound."""
+
+    def __init__(self, cprofile=False, trace_memory=False):
+        self.phase_ns = dict.fromkeys(PHASES, 0)
+        self.phase_calls = dict.fromkeys(PHASES, 0)
+        self.phase_peak_bytes = {}
+        self.cprofile = None
+        self.trace_memory = False
+        self.owns_tracing = False
+        self.stack = []
+        self.mark = 0
+        self.previous_profiler = None
+        self.active = False
+        self.enable_hooks(cprofile, trace_memory)
+
+    def enable_hooks(self, cprofile=False, trace_memory=False):
+        """Turns the cProfile and tracemalloc hooks on for the next profiled spans"""
+        if cprofile and self.cprofile is None:
+            self.cprofile = cProfile.Profile()
+        self.trace_memory = self.trace_memory or trace_memory
+
+    def activate(self):
+        """Makes this profiler the one phase() charges, until deactivate"""
+        global active_profiler
+        self.previous_profiler, active_profiler = active_profiler, self
+        self.active = True
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.owns_tracing = True
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self.mark = perf_counter_ns()
+
+    def deactivate(self):
+        """Closes the open phases and restores the previously active profiler"""
+        global active_profiler
+        while self.stack:
+            self.stop_phase()
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.owns_tracing:
+            tracemalloc.stop()
+            self.owns_tracing = False
+        active_profiler, self.previous_profiler = self.previous_profiler, None
+        self.active = False
+
+    def charge(self):
+        """Charges the time and traced memory peak since the last phase change to the innermost open phase"""
+        now = perf_counter_ns()
+        if self.stack:
+            name = self.stack[-1]
+            self.phase_ns[name] = self.phase_ns.get(name, 0) + now - self.mark
+            if self.trace_memory and tracemalloc.is_tracing():
+                peak = tracemalloc.get_traced_memory()[1]
+                self.phase_peak_bytes[name] = max(self.phase_peak_bytes.get(name, 0), peak)
+        if self.owns_tracing:
+            tracemalloc.reset_peak()
+        self.mark = now
+
+    def start_phase(self, name):
+        self.charge()
+        self.stack.append(name)
+        self.phase_calls[name] = self.phase_calls.get(name, 0) + 1
+
+    def stop_phase(self):
+        self.charge()
+        self.stack.pop()
+
+    @contextmanager
+    def phase(self, name):
+        self.start_phase(name)
+        try:
+            yield
+        finally:
+            self.stop_phase()
+
+    def profile_summary(self, top=PROFILE_TOP_FUNCTIONS):
+        """Returns the functions with the highest cumulative time in the cProfile, or None without the hook"""
+        if self.cprofile is None:
+            return None
+        stats = pstats.Stats(self.cprofile)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        return [{'function': f"{filename}:{line}({name})", 'calls': calls, 'total_seconds': total_time,
+                 'cumulative_seconds': cumulative_time}
+                for (filename, line, name), (_, calls, total_time, cumulative_time, _) in functions]
+
+    def report(self):
+        """Returns the phase times, call counts and memory peaks as a JSON-serializable dict"""
+        return {
+            'phases': {name: {'seconds': self.phase_ns[name] / 1e9, 'calls': self.phase_calls.get(name, 0),
+                              'peak_traced_bytes': self.phase_peak_bytes.get(name)}
+                       for name in self.phase_ns},
+            'total_seconds': sum(self.phase_ns.values()) / 1e9,
+            PEAK_RSS_BYTES: peak_rss_bytes(),
+            'profile': self.profile_summary()
+        }
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process, or None where the resource module is missing"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # kilobytes on Linux
+
+
+def phase(name):
+    """Charges a block to a phase of the active profiler, doing nothing when no profiler is active"""
+    return nullcontext() if active_profiler is None else active_profiler.phase(name)
+
+
+def write_report(report, path):
+    """Writes a profiling report as JSON"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
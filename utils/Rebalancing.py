@@ -0,0 +1,100 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.Constants import MAX_SERVER_LOAD
+from utils.NeighborGraph import gather_pairs
+from utils.PlayerStore import UNALLOCATED
+
+
+def neighbor_votes(players, player_ids, server_count):
+    """Returns, for each given player, how many of its neighbors are allocated in each server"""
+    rows, neighbor_ids = gather_pairs(players.neighbors, player_ids)
+    return np.bincount(rows * server_count + players.server[neighbor_ids],
+                       minlength=len(player_ids) * server_count).reshape(len(player_ids), server_count)
+
+
+def place_orphans(players, orphan_ids):
+    """Allocates players without a valid server in the server of their nearest allocated player, so the players of
+    a removed server are merged into the servers around it"""
+    allocated_ids = np.setdiff1d(players.ids, orphan_ids)
+    _, nearest = cKDTree(players.positions[allocated_ids]).query(players.positions[orphan_ids], workers=-1)
+    players.server[orphan_ids] = players.server[allocated_ids[nearest]]
+
+
+def split_servers(players, first_new_server, server_count):
+    """Gives each added server a share of the players by splitting the most populated server in two across the
+    median of its longer side"""
+    for new_server in range(first_new_server, server_count):
+        player_counts = np.bincount(players.server, minlength=server_count)
+        server_players = np.flatnonzero(players.server == player_counts.argmax())
+        positions = players.positions[server_players]
+        axis = int(np.argmax(positions.max(axis=0) - positions.min(axis=0)))
+        half = len(server_players) // 2
+        upper_half = np.argpartition(positions[:, axis], half)[half:]
+        players.server[server_players[upper_half]] = new_server
+
+
+def overload(loads):
+    """Load above the maximum summed over the servers"""
+    return float(np.maximum(loads - MAX_SERVER_LOAD, 0).sum())
+
+
+def candidate_players(players, seed_ids, overloaded):
+    """Returns the seed players, their neighbors and the players of the overloaded servers, sorted"""
+    _, neighbor_ids = gather_pairs(players.neighbors, seed_ids)
+    candidates = overloaded[players.server] if overloaded.any() else np.zeros(len(players), dtype=bool)
+    candidates[seed_ids] = True
+    candidates[neighbor_ids] = True
+    return np.flatnonzero(candidates)
+
+
+def rebalance_allocation(evaluator, previous_assignment, migration_weight, overload_weight, passes, seed_ids):
+    """Local search from the current allocation minimizing forwards + migration_weight * migrations + overload_weight
+    * overload (in players), one player at a time through the incremental evaluator.
+
+    A pass looks at the seed players (those reassigned or moved since the previous assignment), their neighbors and
+    the players of overloaded servers, and the next pass is seeded with the players it moved, so a pass costs O(k)
+    per candidate whatever the number of players. Only candidates seeing as many neighbors in another server as in
+    their own, or seeing another server from an overloaded one, try the server most of their other neighbors are
+    in. Returns the number of accepted moves"""
+    players = evaluator.players
+    server_count = evaluator.server_count
+    own_cost = evaluator.load_factor_own_cost
+    accepted_moves = 0
+    for _ in range(passes):
+        loads = evaluator.loads
+        overloaded = loads > MAX_SERVER_LOAD
+        player_ids = candidate_players(players, seed_ids, overloaded)
+        rows = np.arange(len(player_ids))
+        servers = players.server[player_ids]
+        votes = neighbor_votes(players, player_ids, server_count)
+        own_votes = votes[rows, servers]
+        votes[rows, servers] = -1
+        majority = votes.argmax(axis=1)
+        majority_votes = votes[rows, majority]
+        # players seeing at least as many neighbors in another server may move there, and any player of an
+        # overloaded server seeing another server
+        movable = (majority_votes >= own_votes) | (overloaded[servers] & (majority_votes > 0))
+        moved_ids = []
+        for player_id, target in zip(player_ids[movable].tolist(), majority[movable].tolist()):
+            source = int(players.server[player_id])
+            loads = evaluator.loads
+            forwards_delta, target_loads = evaluator.score_delta(player_id, target)
+            previous_server = previous_assignment[player_id]
+            migrations_delta = int(target != previous_server) - int(source != previous_server)
+            delta = forwards_delta + migration_weight * migrations_delta + \
+                overload_weight * (overload(target_loads) - overload(loads)) / own_cost
+            if delta < 0:
+                evaluator.move(player_id, target)
+                moved_ids.append(player_id)
+        evaluator.history.clear()
+        accepted_moves += len(moved_ids)
+        if not moved_ids:
+            break
+        seed_ids = np.array(moved_ids, dtype=np.int64)
+    return accepted_moves
+
+
+def count_migrations(previous_assignment, assignment):
+    """Counts the players allocated in a different server than before (newly allocated players included)"""
+    return int(np.count_nonzero((previous_assignment != assignment) & (assignment != UNALLOCATED)))
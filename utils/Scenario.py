@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from utils.Initialization import generate_players
+from utils.NeighborSearch import generate_neighbor_backend, clamp_neighbor_count, KDTREE_BACKEND
+from utils.OutputUtils import get_output_path
+from utils.PlayerStore import PlayerStore
+from utils.ScenarioFile import write_scenario_file, open_scenario_file, build_scenario_file
+
+SCENARIO_FILE_EXTENSION = ".scenario"
+SCENARIO_SEED = 42  # the numpy seed Method.set_fixed_seeds uses, so fixed-seed methods see the same players
+
+
+class Scenario:
+    """Players, spatial index and neighbor matrix generated once from a seed and shared by every method built from
+    it, so each method only runs its own allocation. Methods share the positions and neighbors read-only."""
+
+    def __init__(self, player_count, map_size_x, map_size_y, viewable_players, seed=SCENARIO_SEED,
+                 neighbor_backend=KDTREE_BACKEND, positions=None, neighbors=None, random_state=None):
+        self.player_count = player_count
+        self.map_size_x = map_size_x
+        self.map_size_y = map_size_y
+        self.viewable_players = viewable_players
+        self.seed = seed
+        self.neighbor_backends = {}
+        if positions is None:
+            np.random.seed(seed)
+            positions = generate_players(player_count, map_size_x, map_size_y).positions
+            random_state = np.random.get_state()
+        self.players = PlayerStore(positions, neighbors=neighbors)
+        # the numpy random state right after generating the players, restored by fixed-seed methods
+        self.random_state = random_state
+        if neighbors is None:
+            self.players.neighbors = self.get_neighbor_backend(neighbor_backend).find_k_nearest_players(
+                clamp_neighbor_count(viewable_players, player_count))
+
+    @property
+    def positions(self):
+        return self.players.positions
+
+    @property
+    def neighbors(self):
+        return self.players.neighbors
+
+    @property
+    def parameters(self):
+        return {'player_count': self.player_count, 'map_size_x': self.map_size_x, 'map_size_y': self.map_size_y,
+                'viewable_players': self.viewable_players, 'seed': self.seed}
+
+    @property
+    def key(self):
+        return scenario_key(**self.parameters)
+
+    def get_neighbor_backend(self, backend=KDTREE_BACKEND):
+        """Returns the spatial index of a backend over the scenario players, building it on first use"""
+        if backend not in self.neighbor_backends:
+            self.neighbor_backends[backend] = generate_neighbor_backend(self.players, backend)
+        return self.neighbor_backends[backend]
+
+    def create_players(self):
+        """Returns a player store sharing the scenario positions and neighbors with its own allocations"""
+        return PlayerStore(self.positions, neighbors=self.neighbors)
+
+    def save(self, path):
+        """Saves the positions, neighbors and random state in the binary scenario format (spatial indexes are
+        rebuilt on use)"""
+        write_scenario_file(path, self.parameters, self.positions, self.neighbors, self.random_state)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a scenario file without reading it: the positions and neighbors are read-only memory maps, paged
+        in as the methods use them and shared by every process opening the file"""
+        parameters, random_state, arrays = open_scenario_file(path)
+        return cls(**parameters, positions=arrays['positions'], neighbors=arrays['neighbors'],
+                   random_state=random_state)
+
+    @classmethod
+    def load_or_build(cls, player_count, map_size_x, map_size_y, viewable_players, seed=SCENARIO_SEED,
+                      cache_dir=None):
+        """Loads a scenario from the disk cache, keyed by its parameters and seed, building the file chunk by chunk
+        when missing"""
+        cache_dir = str(cache_dir or get_output_path("scenarios", ""))
+        key = scenario_key(player_count, map_size_x, map_size_y, viewable_players, seed)
+        path = os.path.join(cache_dir, f"scenario_{key}{SCENARIO_FILE_EXTENSION}")
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            build_scenario_file(temporary_path, player_count, map_size_x, map_size_y, viewable_players, seed)
+            os.replace(temporary_path, path)  # atomic, concurrent builders of the same scenario don't clash
+        return cls.load(path)
+
+
+def scenario_key(player_count, map_size_x, map_size_y, viewable_players, seed):
+    """Returns a short hash identifying a scenario by its parameters and seed"""
+    parameters = json.dumps([player_count, map_size_x, map_size_y, viewable_players, seed])
+    return hashlib.sha1(parameters.encode()).hexdigest()[:16]
@@ -0,0 +1,137 @@
+import json
+import struct
+
+import numpy as np
+
+from utils.NeighborSearch import KDTreeBackend, clamp_neighbor_count
+from utils.PlayerStore import PlayerStore
+
+SCENARIO_FILE_MAGIC = b'PLAYSCEN'
+SCENARIO_FILE_VERSION = 1
+PREAMBLE = struct.Struct('<8sII')  # magic, format version, JSON header length
+ARRAY_ALIGNMENT = 64
+PLAYER_CHUNK_SIZE = 2 ** 18  # players generated and searched at once when building a file
+
+
+def aligned(offset):
+    """Rounds an offset up to the array alignment"""
+    return -(-offset // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+
+
+def create_scenario_file(path, parameters, arrays, random_state):
+    """Writes the header of a scenario file and sizes the file for its raw arrays, returning writable memmaps of
+    the arrays to fill. arrays maps each array name to its (shape, dtype)"""
+    algorithm, keys, position, has_gauss, cached_gaussian = random_state
+    arrays = {**arrays, 'random_keys': (np.shape(keys), np.asarray(keys).dtype)}
+    header = {'parameters': parameters,
+              'random_state': {'algorithm': algorithm, 'position': int(position), 'has_gauss': int(has_gauss),
+                               'cached_gaussian': float(cached_gaussian)},
+              'arrays': {}}
+    # the offsets depend on the header length, which depends on the offsets digits: sized with a generous bound
+    offset = aligned(PREAMBLE.size + len(json.dumps(header)) + 128 * (len(arrays) + 1))
+    for name, (shape, dtype) in arrays.items():
+        dtype = np.dtype(dtype)
+        header['arrays'][name] = {'dtype': dtype.str, 'shape': list(shape), 'offset': offset}
+        offset = aligned(offset + int(np.prod(shape)) * dtype.itemsize)
+    encoded_header = json.dumps(header).encode()
+    with open(path, 'wb') as scenario_file:
+        scenario_file.write(PREAMBLE.pack(SCENARIO_FILE_MAGIC, SCENARIO_FILE_VERSION, len(encoded_header)))
+        scenario_file.write(encoded_header)
+        scenario_file.truncate(offset)
+    memmaps = map_arrays(path, header, 'r+')
+    memmaps['random_keys'][:] = keys
+    return memmaps
+
+
+def read_header(path):
+    """Reads and validates the header of a scenario file"""
+    with open(path, 'rb') as scenario_file:
+        preamble = scenario_file.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            raise ValueError(f"{path} is not a scenario file")
+        magic, version, header_length = PREAMBLE.unpack(preamble)
+        if magic != SCENARIO_FILE_MAGIC:
+            raise ValueError(f"{path} is not a scenario file")
+        if version != SCENARIO_FILE_VERSION:
+            raise ValueError(f"Unsupported scenario file version {version} in {path}, "
+                             f"expected {SCENARIO_FILE_VERSION}")
+        return json.loads(scenario_file.read(header_length))
+
+
+def map_arrays(path, header, mode='r'):
+    """Maps every array of a scenario file without reading it"""
+    return {name: np.memmap(path, dtype=array['dtype'], mode=mode, offset=array['offset'],
+                            shape=tuple(array['shape']))
+            for name, array in header['arrays'].items()}
+
+
+def open_scenario_file(path, mode='r'):
+    """Opens a scenario file, returning its parameters, numpy random state and memory-mapped arrays"""
+    header = read_header(path)
+    arrays = map_arrays(path, header, mode)
+    state = header['random_state']
+    random_state = (state['algorithm'], np.asarray(arrays.pop('random_keys')), state['position'],
+                    state['has_gauss'], state['cached_gaussian'])
+    return header['parameters'], random_state, arrays
+
+
+def write_scenario_file(path, parameters, positions, neighbors, random_state):
+    """Writes in-memory positions and neighbors to a scenario file"""
+    arrays = create_scenario_file(path, parameters, {'positions': (positions.shape, np.float64),
+                                                     'neighbors': (neighbors.shape, np.int32)}, random_state)
+    arrays['positions'][:] = positions
+    arrays['neighbors'][:] = neighbors
+    for array in arrays.values():
+        array.flush()
+
+
+def build_scenario_file(path, player_count, map_size_x, map_size_y, viewable_players, seed,
+                        chunk_size=PLAYER_CHUNK_SIZE):
+    """Generates a scenario straight into a file, chunk by chunk: the positions are drawn in the same order as
+    Initialization.generate_players (so they are identical) and the neighbors are searched one chunk of players at a
+    time, keeping only the KD-tree in memory"""
+    np.random.seed(seed)
+    parameters = {'player_count': player_count, 'map_size_x': map_size_x, 'map_size_y': map_size_y,
+                  'viewable_players': viewable_players, 'seed': seed}
+    k = clamp_neighbor_count(viewable_players, player_count)
+    shapes = {'positions': ((player_count, 2), np.float64), 'neighbors': ((player_count, k), np.int32)}
+    random_state_before = np.random.get_state()
+    # the random state stored is the one right after drawing every position, known only once they are drawn
+    arrays = create_scenario_file(path, parameters, shapes, random_state_before)
+    positions, neighbors = arrays['positions'], arrays['neighbors']
+    for first in range(0, player_count, chunk_size):
+        last = min(first + chunk_size, player_count)
+        positions[first:last] = np.random.weibull(3, (last - first, 2))
+    random_state = np.random.get_state()
+    maximums = positions.max(axis=0)
+    for first in range(0, player_count, chunk_size):
+        chunk = positions[first:first + chunk_size]
+        chunk[:, 0] = map_size_x * chunk[:, 0] / maximums[0]
+        chunk[:, 1] = map_size_y * chunk[:, 1] / maximums[1]
+    backend = KDTreeBackend(PlayerStore(positions))
+    for first in range(0, player_count, chunk_size):
+        player_ids = np.arange(first, min(first + chunk_size, player_count))
+        neighbors[first:first + len(player_ids)] = backend.find_k_nearest_players(k, player_ids)
+    positions.flush()
+    neighbors.flush()
+    del arrays, positions, neighbors, backend
+    rewrite_random_state(path, random_state)
+
+
+def rewrite_random_state(path, random_state):
+    """Replaces the random state stored in a scenario file, keeping its layout"""
+    header = read_header(path)
+    algorithm, keys, position, has_gauss, cached_gaussian = random_state
+    header['random_state'] = {'algorithm': algorithm, 'position': int(position), 'has_gauss': int(has_gauss),
+                              'cached_gaussian': float(cached_gaussian)}
+    encoded_header = json.dumps(header).encode()
+    first_offset = min(array['offset'] for array in header['arrays'].values())
+    if PREAMBLE.size + len(encoded_header) > first_offset:
+        raise ValueError(f"The header of {path} has no room for the random state")
+    with open(path, 'r+b') as scenario_file:
+        scenario_file.write(PREAMBLE.pack(SCENARIO_FILE_MAGIC, SCENARIO_FILE_VERSION, len(encoded_header)))
+        scenario_file.write(encoded_header)
+    random_keys = map_arrays(path, header, 'r+')['random_keys']
+    random_keys[:] = keys
+    random_keys.flush()
+
@@ -0,0 +1,26 @@
+import numpy as np
+
+DISTANCE_MATRIX_MAX_SERVERS = 64  # above this many servers the nearest server is found with a KD-tree
+DISTANCE_MATRIX_MAX_CELLS = 2 ** 22  # players x servers distances computed at once
+
+
+def assign_to_nearest_server(positions, server_positions, server_weights=None):
+    """Labels every position with its nearest server (the Voronoi cell it lies in),
+    returning the assignment and the number of players in each server.
+    Server weights are added to the squared distances, shrinking (positive) or growing (negative) a server's cell"""
+    server_count = len(server_positions)
+    if server_count > DISTANCE_MATRIX_MAX_SERVERS and server_weights is None:
+        from scipy.spatial import cKDTree
+        _, assignment = cKDTree(server_positions).query(positions, 1, workers=-1)
+    else:
+        assignment = np.empty(len(positions), dtype=np.int64)
+        chunk_size = max(DISTANCE_MATRIX_MAX_CELLS // max(server_count, 1), 1)
+        for chunk_start in range(0, len(positions), chunk_size):
+            chunk = positions[chunk_start:chunk_start + chunk_size]
+            distances = ((chunk[:, None, :] - server_positions[None, :, :]) ** 2).sum(axis=2)
+            if server_weights is not None:
+                distances += server_weights
+            assignment[chunk_start:chunk_start + chunk_size] = distances.argmin(axis=1)
+    assignment = assignment.astype(np.int32)
+    return assignment, np.bincount(assignment, minlength=server_count)
+
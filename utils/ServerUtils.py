@@ -1,52 +1,135 @@
-from pybloom_live import BloomFilter
+import numpy as np
 
-from utils.Constants import ID, PLAYER_COUNT, LOAD, NEIGHBORS, POS_X, POS_Y, SERVER
-from utils.SpatialIndex import find_k_nearest, find_k_nearest_players
+from utils.AsyncLogger import get_logger
+from utils.Constants import PLAYER_COUNT, LOAD, POS_X, POS_Y, TOTAL_FWDS, FWDS_BY_SERVER, INVALID, \
+    MAX_SERVER_LOAD
+from utils.NeighborGraph import expand_pairs
+from utils.NeighborSearch import clamp_neighbor_count
+from utils.Profiling import phase, KNN_PHASE, PUBLISH_PHASE, LOAD_PHASE
 
+BITSET_MAX_SIZE = 2 ** 28  # servers x players cells above which interest groups are built by sort/unique
+EVALUATION_CHUNK_SIZE = 2 ** 18  # players whose neighbor pairs are expanded at once
 
-def find_k_nearest_servers(index, x, y, k):
-    """Finds k nearest servers to a player's coordinates"""
-    k_nearest = find_k_nearest(index, x, y, k)
-    return k_nearest if len(k_nearest) > 0 else None
 
+def calculate_viewable_players(players, neighbor_backend, k, verbose=False, radius=None):
+    """Calculates the viewable players of each player: the matrix of its k nearest players (every other player when
+    there are no more than k) or, with a radius, the CSR neighbors of every player within the radius of it"""
+    k = clamp_neighbor_count(k, len(players))
+    with phase(KNN_PHASE):
+        if radius is None:
+            players.neighbors = neighbor_backend.find_k_nearest_players(k)
+        else:
+            players.neighbors = neighbor_backend.find_players_in_radius(radius)
+    if verbose and radius is None:
+        get_logger().player_events(f"{k} nearest neighbors from player {{player}}: {{neighbors}}", player=players.ids,
+                                   neighbors=players.neighbors)
+    elif verbose:
+        get_logger().player_events(f"{{count}} players within {radius} of player {{player}}", player=players.ids,
+                                   count=players.neighbors.degrees)
 
-def calculate_load_factors(server_list, load_factor_own_cost, load_factor_forward_cost, interest_groups):
-    """Calculates the server's load factor"""
-    for server in server_list:
-        current_server = server[ID]
-        server[LOAD] = server[PLAYER_COUNT] * load_factor_own_cost + \
-                       interest_groups[current_server].count * load_factor_forward_cost
-    return [server[LOAD] for server in server_list]
+
+def update_player_counts(players, server_list):
+    """Updates the player count of each server from the players allocation"""
+    for server, count in zip(server_list, players.player_counts(len(server_list)).tolist()):
+        server[PLAYER_COUNT] = count
+
+
+def neighbor_pairs(players):
+    """Returns every (player, neighbor) pair of the visibility graph as two flat arrays"""
+    return expand_pairs(players.neighbors)
+
+
+def foreign_neighbor_pairs(players, first=0, last=None):
+    """Returns the (server, neighbor) pairs of the players first to last where the neighbor belongs to another
+    server"""
+    player_ids, neighbor_ids = expand_pairs(players.neighbors, first, last)
+    servers = players.server[player_ids]
+    foreign = players.server[neighbor_ids] != servers
+    return servers[foreign], neighbor_ids[foreign]
+
+
+def chunked_foreign_neighbor_pairs(players, chunk_size=EVALUATION_CHUNK_SIZE):
+    """Yields the foreign (server, neighbor) pairs one chunk of players at a time, so the N x k pairs are never
+    expanded at once and memory-mapped neighbors are read sequentially"""
+    for first in range(0, len(players), chunk_size):
+        yield foreign_neighbor_pairs(players, first, first + chunk_size)
 
 
-def calculate_viewable_players(players_list, players_spatial_index, k, verbose=False):
-    """Calculates the list of viewable players by a single player"""
-    for player in players_list:
-        player[NEIGHBORS] = find_k_nearest_players(players_spatial_index, player[POS_X], player[POS_Y], k)
-        if verbose:
-            print(f"{k} nearest neighbors from player {player[ID]}: {player[NEIGHBORS]}")
+def interest_group_members(players, server_count):
+    """Returns the (servers, players) bitset of the foreign players each server receives data about"""
+    members = np.zeros((server_count, len(players)), dtype=bool)
+    for servers, neighbor_ids in chunked_foreign_neighbor_pairs(players):
+        members[servers, neighbor_ids] = True
+    return members
 
 
-def publish_interest_groups(player_list, server_list, verbose=False):
+def interest_group_keys(players):
+    """Returns the sorted distinct server * N + neighbor keys of the foreign pairs, deduplicated chunk by chunk"""
+    player_count = len(players)
+    keys = [np.unique(servers.astype(np.int64) * player_count + neighbor_ids)
+            for servers, neighbor_ids in chunked_foreign_neighbor_pairs(players)]
+    return keys[0] if len(keys) == 1 else np.unique(np.concatenate([np.empty(0, dtype=np.int64), *keys]))
+
+
+def count_forwards(players, server_count):
+    """Counts the distinct foreign players each server receives data about"""
+    player_count = len(players)
+    if server_count * player_count <= BITSET_MAX_SIZE:
+        return np.count_nonzero(interest_group_members(players, server_count), axis=1)
+    return np.bincount(interest_group_keys(players) // player_count, minlength=server_count)
+
+
+def evaluate_allocation(players, server_count, load_factor_own_cost, load_factor_forward_cost,
+                        approximate=False):
+    """Evaluates forwards, loads, viability and player counts of an allocation in a single pass"""
+    with phase(PUBLISH_PHASE):
+        if approximate:
+            forwards_by_server = np.array([len(interest_group) for interest_group in
+                                           publish_interest_groups(players, range(server_count), approximate=True)])
+        else:
+            forwards_by_server = count_forwards(players, server_count)
+    with phase(LOAD_PHASE):
+        player_counts = players.player_counts(server_count)
+        loads = player_counts * load_factor_own_cost + forwards_by_server * load_factor_forward_cost
+    return {
+        TOTAL_FWDS: int(forwards_by_server.sum()),
+        FWDS_BY_SERVER: forwards_by_server.tolist(),
+        LOAD: loads.tolist(),
+        INVALID: bool((loads > MAX_SERVER_LOAD).any()),
+        PLAYER_COUNT: player_counts.tolist()
+    }
+
+
+def publish_interest_groups(players, server_list, verbose=False, approximate=False):
     """Publishes the interest groups of each server
     (the players that the server has to receive data about from the servers that they belong to)"""
-    player_count = len(player_list)
-    interest_groups = [BloomFilter(player_count ** 2, error_rate=0.1) for server in server_list]
-    for player in player_list:
-        server = player[SERVER]
-        interest_group = interest_groups[server]
-        for neighbor_id in player[NEIGHBORS]:
-            if player_list[neighbor_id][SERVER] != server:
-                if verbose:
-                    print(f"Player {neighbor_id} added to interest group of server {player[SERVER]}")
-                interest_group.add(neighbor_id)
+    player_count = len(players)
+    server_count = len(server_list)
+    if approximate:
+        from pybloom_live import BloomFilter
+
+        interest_groups = [BloomFilter(max(player_count, 1), error_rate=0.1) for _ in server_list]
+        for servers, neighbor_ids in chunked_foreign_neighbor_pairs(players):
+            for server, neighbor_id in zip(servers.tolist(), neighbor_ids.tolist()):
+                interest_groups[server].add(neighbor_id)
+    elif server_count * player_count <= BITSET_MAX_SIZE:
+        interest_groups = [np.flatnonzero(server_members)
+                           for server_members in interest_group_members(players, server_count)]
+    else:
+        keys = interest_group_keys(players)
+        bounds = np.searchsorted(keys, np.arange(server_count + 1, dtype=np.int64) * player_count)
+        interest_groups = [keys[bounds[server]:bounds[server + 1]] - server * player_count
+                           for server in range(server_count)]
+    if verbose and not approximate:
+        for server, interest_group in enumerate(interest_groups):
+            get_logger().player_events(f"Player {{player}} added to interest group of server {server}",
+                                       player=interest_group)
     return interest_groups
 
 
-def clear_allocations(player_list, server_list):
+def clear_allocations(players, server_list):
     """Resets player and server configurations"""
-    for player in player_list:
-        del player[SERVER]
+    players.clear_allocations()
     for server in server_list:
         server[PLAYER_COUNT] = 0
         try:
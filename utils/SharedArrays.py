@@ -0,0 +1,66 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from utils.NeighborGraph import CsrNeighbors
+
+
+def memmap_source(array):
+    """Returns the memory-mapped file backing an array, or None if it lives in memory"""
+    base = array
+    while base is not None and not isinstance(base, np.memmap):
+        base = getattr(base, 'base', None)
+    if base is None or getattr(base, 'filename', None) is None or not array.flags.c_contiguous:
+        return None
+    return base
+
+
+def share_array(array):
+    """Copies an array into a new shared memory block, returning the block and the descriptor used to attach to it.
+    Arrays memory-mapped from a file are not copied: workers map the same file, and the block is None"""
+    source = memmap_source(array)
+    if source is not None:
+        offset = source.offset + (array.__array_interface__['data'][0] - source.__array_interface__['data'][0])
+        return None, (source.filename, array.shape, array.dtype.str, offset)
+    shared_memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory.buf)[...] = array
+    return shared_memory, (shared_memory.name, array.shape, array.dtype.str)
+
+
+def attach_array(descriptor):
+    """Attaches to an array shared by share_array, returning the block (which must be kept alive) and the array"""
+    if len(descriptor) == 4:
+        filename, shape, dtype, offset = descriptor
+        return None, np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+    name, shape, dtype = descriptor
+    shared_memory = SharedMemory(name=name)
+    return shared_memory, np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf)
+
+
+def share_neighbors(neighbors):
+    """Shares a neighbor matrix or both arrays of CSR neighbors, returning the blocks and the descriptor"""
+    if isinstance(neighbors, CsrNeighbors):
+        indptr_memory, indptr_descriptor = share_array(neighbors.indptr)
+        indices_memory, indices_descriptor = share_array(neighbors.indices)
+        return [indptr_memory, indices_memory], (indptr_descriptor, indices_descriptor)
+    shared_memory, descriptor = share_array(neighbors)
+    return [shared_memory], descriptor
+
+
+def attach_neighbors(descriptor):
+    """Attaches to neighbors shared by share_neighbors, returning the blocks (which must be kept alive) and the
+    neighbors"""
+    if isinstance(descriptor[0], tuple):
+        indptr_memory, indptr = attach_array(descriptor[0])
+        indices_memory, indices = attach_array(descriptor[1])
+        return [indptr_memory, indices_memory], CsrNeighbors(indptr, indices)
+    shared_memory, neighbors = attach_array(descriptor)
+    return [shared_memory], neighbors
+
+
+def release_shared_memory(*shared_memories):
+    """Closes and frees shared memory blocks created by share_array"""
+    for shared_memory in shared_memories:
+        if shared_memory is not None:
+            shared_memory.close()
+            shared_memory.unlink()
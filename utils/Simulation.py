@@ -0,0 +1,88 @@
+from time import perf_counter
+
+import numpy as np
+
+from utils.AsyncLogger import get_logger
+from utils.Constants import TICK, TICK_LATENCY, TOTAL_FWDS, MIGRATIONS, MOVED_PLAYERS, UPDATED_NEIGHBORS, \
+    REPARTITIONED, INVALID, SIMULATION_TICKS, LOAD
+from utils.NeighborSearch import IncrementalNeighbors
+from utils.PlayerStore import UNALLOCATED
+from utils.Rebalancing import count_migrations
+
+
+class Simulation:
+    """Moves the players of a method over ticks, updating its spatial index and viewable players incrementally.
+
+    Assignments are sticky: players keep their server while they move, unless the method repartitions every
+    repartition_interval ticks (0 never repartitions), from scratch or, with a migration_weight, rebalancing the
+    previous assignment. Each tick reports its latency, forwards and migrations."""
+
+    def __init__(self, method, movement_model, repartition_interval=0, migration_weight=None, verbose=False):
+        if method.visibility_radius is not None:
+            raise ValueError("Simulations keep the k nearest players up to date, radius visibility is not supported")
+        self.method = method
+        self.movement_model = movement_model
+        self.repartition_interval = repartition_interval
+        self.migration_weight = migration_weight
+        self.verbose = verbose
+        self.tick = 0
+        method.detach_from_scenario()  # the players move, other methods sharing the scenario must not see it
+        self.neighbors = IncrementalNeighbors(method.players, method.neighbor_backend, method.viewable_players)
+        # neighbors at the last repartition and players whose neighbors were searched again since, so rebalancing
+        # only replaces the lists that changed in the evaluator it keeps
+        self.repartition_neighbors = method.players.neighbors.copy() if migration_weight is not None else None
+        self.changed = np.zeros(len(method.players), dtype=bool)
+        self.tick_results = []
+
+    def step(self):
+        """Runs one tick: moves the players, updates the index and neighbors, optionally repartitions and
+        evaluates the allocation"""
+        method = self.method
+        players = method.players
+        start = perf_counter()
+        self.tick += 1
+        moved_ids, old_positions = self.movement_model.move(players)
+        updated_ids = self.neighbors.update(moved_ids, old_positions)
+        method.players_moved(moved_ids)
+        self.changed[updated_ids] = True
+        repartitioned = self.repartition_interval > 0 and self.tick % self.repartition_interval == 0
+        migrations = 0
+        if repartitioned:
+            previous_servers = players.server.copy()
+            changed_ids = np.flatnonzero(self.changed)
+            self.changed[:] = False
+            if self.migration_weight is None:
+                method.allocate_players()
+            else:
+                method.neighbors_replaced(changed_ids, self.repartition_neighbors[changed_ids])
+                self.repartition_neighbors[changed_ids] = players.neighbors[changed_ids]
+                method.rebalance_players(previous_servers, migration_weight=self.migration_weight,
+                                         changed_ids=changed_ids)
+            migrations = count_migrations(previous_servers, players.server)
+        evaluation = method.evaluate_allocation()
+        tick_result = {
+            TICK: self.tick,
+            TICK_LATENCY: perf_counter() - start,
+            TOTAL_FWDS: evaluation[TOTAL_FWDS],
+            MIGRATIONS: migrations,
+            MOVED_PLAYERS: len(moved_ids),
+            UPDATED_NEIGHBORS: len(updated_ids),
+            REPARTITIONED: repartitioned,
+            INVALID: evaluation[INVALID],
+            LOAD: evaluation[LOAD]
+        }
+        if self.verbose:
+            get_logger().info(f"Tick {self.tick}: {tick_result[TOTAL_FWDS]} forwards, {migrations} migrations, "
+                              f"{len(updated_ids)} neighbor lists updated in {tick_result[TICK_LATENCY]:.4f} seconds")
+        self.tick_results.append(tick_result)
+        return tick_result
+
+    def run(self, ticks):
+        """Runs a number of ticks, allocating the players first if the method did not, and stores the per-tick
+        results in the method data output"""
+        if (self.method.players.server == UNALLOCATED).any():
+            self.method.allocate_players()
+        for _ in range(ticks):
+            self.step()
+        self.method.data_output[SIMULATION_TICKS] = self.tick_results
+        return self.tick_results
@@ -0,0 +1,77 @@
+import numpy as np
+
+HILBERT_CURVE = 'hilbert'
+MORTON_CURVE = 'morton'
+CURVE_BITS = 16  # bits per axis, the curve visits a 2^16 x 2^16 grid
+
+
+def quantize_positions(positions, map_size_x, map_size_y, bits):
+    """Maps positions to integer cells of a 2^bits x 2^bits grid covering the map"""
+    side = 1 << bits
+    scale = np.array([side / map_size_x, side / map_size_y])
+    cells = np.floor(positions * scale).astype(np.int64)
+    np.clip(cells, 0, side - 1, out=cells)
+    return cells[:, 0], cells[:, 1]
+
+
+def spread_bits(values):
+    """Inserts a zero bit between each of the lower 32 bits of the values"""
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def morton_keys(cell_x, cell_y, bits):
+    """Z-order keys: the bits of both coordinates interleaved"""
+    return spread_bits(cell_x) | (spread_bits(cell_y) << np.uint64(1))
+
+
+def hilbert_keys(cell_x, cell_y, bits):
+    """Hilbert curve keys, one vectorized step per bit from the most significant one"""
+    side = 1 << bits
+    x, y = cell_x.astype(np.int64), cell_y.astype(np.int64)
+    keys = np.zeros(len(x), dtype=np.uint64)
+    step = side >> 1
+    while step > 0:
+        rx = (x & step) > 0
+        ry = (y & step) > 0
+        keys += np.uint64(step) * np.uint64(step) * ((3 * rx) ^ ry).astype(np.uint64)
+        # rotates the quadrant so the lower bits follow the curve orientation
+        flip = ~ry & rx
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        step >>= 1
+    return keys
+
+
+SPACE_FILLING_CURVES = {
+    HILBERT_CURVE: hilbert_keys,
+    MORTON_CURVE: morton_keys
+}
+
+
+def curve_keys(positions, map_size_x, map_size_y, curve=HILBERT_CURVE, bits=CURVE_BITS):
+    """Returns the position of each player along a space-filling curve covering the map"""
+    if curve not in SPACE_FILLING_CURVES:
+        raise ValueError(f"Unknown space-filling curve {curve}, expected one of {list(SPACE_FILLING_CURVES)}")
+    if not 0 < bits <= 32:
+        raise ValueError(f"Curve bits must be between 1 and 32, got {bits}")
+    cell_x, cell_y = quantize_positions(positions, map_size_x, map_size_y, bits)
+    return SPACE_FILLING_CURVES[curve](cell_x, cell_y, bits)
+
+
+def split_curve_order(curve_order, chunk_sizes):
+    """Assigns contiguous chunks of the players sorted along the curve to consecutive servers"""
+    assignment = np.empty(len(curve_order), dtype=np.int32)
+    assignment[curve_order] = np.repeat(np.arange(len(chunk_sizes), dtype=np.int32), chunk_sizes)
+    return assignment
+
+
+def balanced_chunk_sizes(player_count, server_capacities):
+    """Splits the players proportionally to each server's capacity, the sizes summing exactly to player_count"""
+    server_capacities = np.asarray(server_capacities, dtype=np.float64)
+    boundaries = np.round(np.cumsum(server_capacities) / server_capacities.sum() * player_count).astype(np.int64)
+    return np.diff(np.r_[0, boundaries])
@@ -0,0 +1,284 @@
+import tempfile
+from math import ceil
+
+import numpy as np
+
+from utils.Constants import TOTAL_FWDS, FWDS_BY_SERVER, LOAD, INVALID, PLAYER_COUNT, MAX_SERVER_LOAD
+from utils.NeighborSearch import exclude_self, clamp_neighbor_count
+from utils.PlayerStore import UNALLOCATED
+
+STREAMING_CHUNK_SIZE = 2 ** 18  # players read from the source at once
+DEFAULT_MEMORY_BUDGET = 2 ** 28  # bytes, half for a band, a quarter for the search of a tile and for the bitset
+BAND_BYTES_PER_PLAYER = 128  # id, position and masks of a player gathered in a band, with the gathered chunks
+TILE_BYTES_PER_NEIGHBOR = 160  # distance, candidate, foreign pair and bit of a neighbor searched in a tile
+UNRESOLVED_BYTES_PER_NEIGHBOR = 64  # merged distances and candidates of a neighbor searched over the whole stream
+POPCOUNTS = np.array([bin(value).count('1') for value in range(256)], dtype=np.int64)
+HALO_FACTOR = 2.0  # halo width, in k-th neighbor distances at the mean player density
+TIE_MARGIN = 1e-9  # relative margin over the (k + 1)-th distance, so every player tied at it is gathered
+RADIUS_HALO_MARGIN = 1e-9  # relative margin of the radius halo over the radius, so players at the radius are inside
+POSITION_SAMPLE_SIZE = 2 ** 16  # positions kept to place the tile edges at the density quantiles
+
+
+def array_chunks(positions, chunk_size=STREAMING_CHUNK_SIZE):
+    """Returns a chunk source over a positions array, in memory or memory-mapped: a function returning a new
+    generator of the (ids, positions) of consecutive chunks of players on each call"""
+    def chunks():
+        for first in range(0, len(positions), chunk_size):
+            chunk = np.asarray(positions[first:first + chunk_size], dtype=np.float64)
+            yield np.arange(first, first + len(chunk)), chunk
+    return chunks
+
+
+def scan_players(player_chunks):
+    """Streams the players once, returning their count, bounding box and a strided sample of their positions"""
+    player_count = 0
+    lower, upper = np.full(2, np.inf), np.full(2, -np.inf)
+    samples, sampled, stride = [], 0, 1
+    for _, positions in player_chunks():
+        player_count += len(positions)
+        if len(positions) > 0:
+            lower = np.minimum(lower, positions.min(axis=0))
+            upper = np.maximum(upper, positions.max(axis=0))
+        samples.append(positions[::stride])
+        sampled += len(samples[-1])
+        if sampled > 2 * POSITION_SAMPLE_SIZE:  # halves the sample, keeping it bounded whatever the player count
+            samples = [np.concatenate(samples)[::2]]
+            sampled = len(samples[0])
+            stride *= 2
+    return player_count, lower, upper, np.concatenate(samples) if samples else np.empty((0, 2))
+
+
+def quantile_edges(values, part_count):
+    """Edges splitting values in parts of equal counts, open at both ends"""
+    inner = np.quantile(values, np.linspace(0, 1, part_count + 1)[1:-1]) if len(values) > 0 else []
+    return np.concatenate([[-np.inf], inner, [np.inf]])
+
+
+def gather_players(player_chunks, axis, low, high):
+    """Streams the players, keeping the ids and positions of those with low <= coordinate < high on an axis"""
+    ids, positions = [], []
+    for chunk_ids, chunk_positions in player_chunks():
+        inside = (chunk_positions[:, axis] >= low) & (chunk_positions[:, axis] < high)
+        ids.append(chunk_ids[inside])
+        positions.append(chunk_positions[inside])
+    return np.concatenate(ids), np.concatenate(positions)
+
+
+def nearest_others(rows, candidate_ids, distances, query_ids, k):
+    """k nearest players of each query from flat (row, candidate, distance) triples holding at least its k nearest
+    other players, ties broken by lowest id so the result does not depend on how the candidates were found"""
+    others = candidate_ids != query_ids[rows]
+    rows, candidate_ids, distances = rows[others], candidate_ids[others], distances[others]
+    order = np.lexsort((candidate_ids, distances, rows))
+    rows, candidate_ids = rows[order], candidate_ids[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    return candidate_ids[ranks < k].reshape(len(query_ids), k).astype(np.int32)
+
+
+def ball_triples(tree, tree_ids, tree_positions, positions, radii):
+    """Flat (row, player, distance) triples of every player of a tree within the radius of each position"""
+    balls = tree.query_ball_point(positions, radii, workers=-1)
+    counts = np.array([len(ball) for ball in balls], dtype=np.int64)
+    rows = np.repeat(np.arange(len(positions)), counts)
+    indices = np.concatenate([np.asarray(ball, dtype=np.int64) for ball in balls]) if len(balls) else \
+        np.empty(0, dtype=np.int64)
+    distances = np.linalg.norm(tree_positions[indices] - positions[rows], axis=1)
+    return rows, tree_ids[indices], distances
+
+
+def exact_neighbors(player_chunks, player_ids, positions, k):
+    """k nearest players of a few players over the whole stream, ties broken by lowest id: a first pass merges the
+    k + 1 nearest distances of every chunk and a second gathers every player within the (k + 1)-th, so the result
+    is exact whatever the chunk order"""
+    from scipy.spatial import cKDTree
+
+    best_distances = np.full((len(player_ids), k + 1), np.inf)
+    for _, chunk_positions in player_chunks():
+        if len(chunk_positions) == 0:
+            continue
+        candidate_count = min(k + 1, len(chunk_positions))
+        distances, _ = cKDTree(chunk_positions).query(positions, candidate_count, workers=-1)
+        distances = np.hstack([best_distances, distances.reshape(len(player_ids), candidate_count)])
+        best_distances = np.sort(distances, axis=1)[:, :k + 1]
+    radii = best_distances[:, -1] * (1 + TIE_MARGIN)
+    triples = []
+    for chunk_ids, chunk_positions in player_chunks():
+        if len(chunk_ids) > 0:
+            triples.append(ball_triples(cKDTree(chunk_positions), chunk_ids, chunk_positions, positions, radii))
+    rows, candidate_ids, distances = (np.concatenate(parts) for parts in zip(*triples))
+    return nearest_others(rows, candidate_ids, distances, player_ids, k)
+
+
+def tile_neighbors(core_ids, core_positions, region_ids, region_positions, region_bounds, k):
+    """k nearest players of the core players of a tile searched among the tile and its halo, ties broken by lowest
+    id. Returns the neighbors of the resolved players and a mask of the players whose k-th neighbor may lie outside
+    the halo, for which the halo is too thin (their k-th neighbor is farther than the region edge)"""
+    from scipy.spatial import cKDTree
+
+    if len(region_ids) <= k:
+        return np.empty((0, k), dtype=np.int32), np.ones(len(core_ids), dtype=bool)
+    tree = cKDTree(region_positions)
+    distances, candidates = tree.query(core_positions, k + 1, workers=-1)
+    distances, candidates = distances.reshape(len(core_ids), k + 1), candidates.reshape(len(core_ids), k + 1)
+    radii = distances[:, -1] * (1 + TIE_MARGIN)
+    (x_low, x_high), (y_low, y_high) = region_bounds
+    edge_distances = np.minimum.reduce([core_positions[:, 0] - x_low, x_high - core_positions[:, 0],
+                                        core_positions[:, 1] - y_low, y_high - core_positions[:, 1]])
+    unresolved = radii >= edge_distances
+    resolved = np.flatnonzero(~unresolved)
+    neighbors = exclude_self(region_ids[candidates[resolved]], core_ids[resolved], k)
+    # players with more than k + 1 players at their (k + 1)-th distance choose among the ties by id
+    tied = resolved[tree.query_ball_point(core_positions[resolved], radii[resolved], return_length=True,
+                                          workers=-1) > k + 1]
+    if len(tied) > 0:
+        rows, candidate_ids, tied_distances = ball_triples(tree, region_ids, region_positions, core_positions[tied],
+                                                           radii[tied])
+        neighbors[np.searchsorted(resolved, tied)] = nearest_others(rows, candidate_ids, tied_distances,
+                                                                    core_ids[tied], k)
+    return neighbors, unresolved
+
+
+def tile_radius_pairs(core_ids, core_positions, region_ids, region_positions, radius):
+    """(player, neighbor) pairs of the core players of a tile with every other player within radius, searched among
+    the tile and a halo of one radius, which holds all of them"""
+    from scipy.spatial import cKDTree
+
+    pairs = cKDTree(core_positions).sparse_distance_matrix(cKDTree(region_positions), radius, output_type='ndarray')
+    player_ids, neighbor_ids = core_ids[pairs['i']], region_ids[pairs['j']]
+    others = player_ids != neighbor_ids
+    return player_ids[others], neighbor_ids[others]
+
+
+def foreign_pairs(servers, player_ids, neighbor_ids):
+    """(server, neighbor) pairs of the neighbors in another server than their player, from the (N, k) neighbors of
+    player_ids or flat (player, neighbor) pairs"""
+    if neighbor_ids.ndim == 2:
+        player_ids, neighbor_ids = np.repeat(player_ids, neighbor_ids.shape[1]), neighbor_ids.ravel()
+    player_servers = np.asarray(servers[player_ids])
+    foreign = np.asarray(servers[neighbor_ids]) != player_servers
+    return player_servers[foreign], neighbor_ids[foreign]
+
+
+class ForwardBitset:
+    """One bit per (server, player) pair, set when a player of the server sees that player in another server: the
+    forwards of an allocation deduplicated in S * N / 8 bytes whatever the number of neighbors found. Held in memory
+    within the given bytes and memory-mapped in a temporary file past them"""
+
+    def __init__(self, server_count, player_count, memory_budget):
+        self.row_bytes = (player_count + 7) // 8
+        shape = (server_count, self.row_bytes)
+        if server_count * self.row_bytes <= memory_budget:
+            self.bits = np.zeros(shape, dtype=np.uint8)
+        else:
+            self.file = tempfile.TemporaryFile()
+            self.bits = np.memmap(self.file, dtype=np.uint8, mode='w+', shape=shape)
+
+    def add(self, servers, player_ids):
+        np.bitwise_or.at(self.bits, (servers, player_ids >> 3), np.left_shift(1, player_ids & 7).astype(np.uint8))
+
+    def counts(self):
+        """Number of pairs set for each server"""
+        counts = np.zeros(len(self.bits), dtype=np.int64)
+        for first in range(0, self.row_bytes, STREAMING_CHUNK_SIZE):
+            counts += POPCOUNTS[self.bits[:, first:first + STREAMING_CHUNK_SIZE]].sum(axis=1)
+        return counts
+
+
+def plan_tiles(player_count, neighbor_count, memory_budget):
+    """Numbers of bands and of tiles per band keeping a band of players within half the memory budget and the
+    search of a tile, for neighbor_count neighbors per player, within a quarter"""
+    band_count = max(1, ceil(player_count * BAND_BYTES_PER_PLAYER / (memory_budget / 2)))
+    band_players = player_count / band_count
+    tile_count = max(1, ceil(band_players * (neighbor_count + 1) * TILE_BYTES_PER_NEIGHBOR / (memory_budget / 4)))
+    return band_count, tile_count
+
+
+def streaming_forwards(player_chunks, servers, server_count, k, memory_budget=DEFAULT_MEMORY_BUDGET,
+                       visibility_radius=None):
+    """Forwards of each server of an allocation without the neighbor matrix nor every position in memory: the map
+    is cut in bands along y and each band in tiles along x, at the density quantiles, and each tile searches the
+    nearest players of its players among the tile plus a halo margin. Players whose k-th neighbor may lie beyond the
+    halo are searched again over the whole stream, so the neighbors are exactly the k nearest players, ties at the
+    k-th distance broken by lowest id whatever the tiling, chunking and budget. The foreign neighbors are folded into
+    a ForwardBitset as each tile is searched. With a visibility_radius the neighbors are the players within it, as in
+    the radius model, and a halo of one radius makes every tile exact.
+
+    Streams the players once per band plus up to three times, and twice more each time the players left unresolved
+    would exceed the budget. Memory stays within the budget, down to a floor of a few chunks of the source"""
+    player_count, lower, upper, sample = scan_players(player_chunks)
+    if visibility_radius is not None and visibility_radius <= 0:
+        raise ValueError(f"The visibility radius must be positive, got {visibility_radius}")
+    k = clamp_neighbor_count(k, player_count)
+    forwards = ForwardBitset(server_count, player_count, memory_budget // 4)
+    if player_count == 0 or (k == 0 and visibility_radius is None):
+        return forwards.counts(), player_count
+    area = max(float(np.prod(upper - lower)), np.finfo(np.float64).eps)
+    if visibility_radius is None:
+        halo = HALO_FACTOR * np.sqrt(k * area / (np.pi * player_count))
+        neighbor_count = k
+    else:
+        halo = visibility_radius * (1 + RADIUS_HALO_MARGIN)
+        neighbor_count = ceil(np.pi * visibility_radius ** 2 * player_count / area)
+    band_count, tile_count = plan_tiles(player_count, neighbor_count, memory_budget)
+    unresolved_limit = max(1, memory_budget // (4 * (k + 1) * UNRESOLVED_BYTES_PER_NEIGHBOR))
+    unresolved_ids, unresolved_positions = [], []
+
+    def resolve():
+        ids = np.concatenate(unresolved_ids)
+        forwards.add(*foreign_pairs(servers, ids, exact_neighbors(player_chunks, ids,
+                                                                   np.concatenate(unresolved_positions), k)))
+        unresolved_ids.clear()
+        unresolved_positions.clear()
+
+    band_edges = quantile_edges(sample[:, 1], band_count)
+    for y_low, y_high in zip(band_edges[:-1], band_edges[1:]):
+        band_ids, band_positions = gather_players(player_chunks, 1, y_low - halo, y_high + halo)
+        in_core_band = (band_positions[:, 1] >= y_low) & (band_positions[:, 1] < y_high)
+        tile_edges = quantile_edges(band_positions[in_core_band, 0], tile_count)
+        for x_low, x_high in zip(tile_edges[:-1], tile_edges[1:]):
+            in_region = (band_positions[:, 0] >= x_low - halo) & (band_positions[:, 0] < x_high + halo)
+            in_core = in_core_band & (band_positions[:, 0] >= x_low) & (band_positions[:, 0] < x_high)
+            if not in_core.any():
+                continue
+            core_ids, core_positions = band_ids[in_core], band_positions[in_core]
+            if visibility_radius is not None:
+                forwards.add(*foreign_pairs(servers, *tile_radius_pairs(core_ids, core_positions, band_ids[in_region],
+                                                                        band_positions[in_region], visibility_radius)))
+                continue
+            neighbors, unresolved = tile_neighbors(core_ids, core_positions, band_ids[in_region],
+                                                   band_positions[in_region],
+                                                   ((x_low - halo, x_high + halo), (y_low - halo, y_high + halo)), k)
+            forwards.add(*foreign_pairs(servers, core_ids[~unresolved], neighbors))
+            if unresolved.any():
+                unresolved_ids.append(core_ids[unresolved])
+                unresolved_positions.append(core_positions[unresolved])
+                if sum(len(ids) for ids in unresolved_ids) >= unresolved_limit:
+                    resolve()
+    if unresolved_ids:
+        resolve()
+    return forwards.counts(), player_count
+
+
+def streaming_evaluate_allocation(player_chunks, servers, server_count, k, load_factor_own_cost,
+                                  load_factor_forward_cost, memory_budget=DEFAULT_MEMORY_BUDGET,
+                                  visibility_radius=None):
+    """Evaluates an allocation like ServerUtils.evaluate_allocation, streaming the players from a chunk source (see
+    array_chunks) instead of holding every position and the neighbor matrix in memory.
+    servers is the server of each player, indexed by id (it may be memory-mapped). With a visibility_radius the
+    players see every other player within it instead of their k nearest, like the radius visibility model.
+    The results are identical to the in-memory ones when no player has several neighbors tied at its k-th distance;
+    with ties the in-memory backends may each keep other players, while the stream keeps the lowest ids"""
+    forwards_by_server, player_count = streaming_forwards(player_chunks, servers, server_count, k, memory_budget,
+                                                          visibility_radius)
+    player_counts = np.zeros(server_count, dtype=np.int64)
+    for first in range(0, player_count, STREAMING_CHUNK_SIZE):
+        chunk_servers = np.asarray(servers[first:first + STREAMING_CHUNK_SIZE])
+        player_counts += np.bincount(chunk_servers[chunk_servers != UNALLOCATED], minlength=server_count)
+    loads = player_counts * load_factor_own_cost + forwards_by_server * load_factor_forward_cost
+    return {
+        TOTAL_FWDS: int(forwards_by_server.sum()),
+        FWDS_BY_SERVER: forwards_by_server.tolist(),
+        LOAD: loads.tolist(),
+        INVALID: bool((loads > MAX_SERVER_LOAD).any()),
+        PLAYER_COUNT: player_counts.tolist()
+    }
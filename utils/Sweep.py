@@ -0,0 +1,163 @@
+import contextlib
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from importlib import import_module
+from itertools import product
+from random import seed
+from time import perf_counter
+
+import numpy as np
+
+from utils.AsyncLogger import silenced_logging
+from utils.Constants import TOTAL_FWDS, INVALID, LOAD, PLAYER_COUNT, TOTAL_TIME_ELAPSED, METHOD, SEED, \
+    SCENARIO_KEY, SETUP_TIME, MAX_LOAD_COLUMN, MEAN_LOAD, MIN_PLAYER_COUNT, MAX_PLAYER_COUNT, PROFILE, \
+    PEAK_RSS_BYTES, METHOD_OPTIONS
+from utils.OutputUtils import get_output_path
+from utils.Profiling import PHASES, PHASE_COLUMNS
+from utils.Scenario import Scenario
+
+HASHING_METHOD = 'hashing'
+PARTITION_METHOD = 'partition'
+GRID_METHOD = 'grid'
+FOCUS_METHOD = 'focus'
+QUANTILE_PARTITION_METHOD = 'quantile_partition'
+KD_PARTITION_METHOD = 'kd_partition'
+GRAPH_PARTITION_METHOD = 'graph_partition'
+SPACE_FILLING_CURVE_METHOD = 'space_filling_curve'
+
+METHOD_CLASSES = {
+    HASHING_METHOD: ('methods.Hashing', 'Hashing'),
+    PARTITION_METHOD: ('methods.Partition', 'Partition'),
+    GRID_METHOD: ('methods.Grid', 'Grid'),
+    FOCUS_METHOD: ('methods.Focus', 'Focus'),
+    QUANTILE_PARTITION_METHOD: ('methods.QuantilePartition', 'QuantilePartition'),
+    KD_PARTITION_METHOD: ('methods.KdPartition', 'KdPartition'),
+    GRAPH_PARTITION_METHOD: ('methods.GraphPartition', 'GraphPartition'),
+    SPACE_FILLING_CURVE_METHOD: ('methods.SpaceFillingCurve', 'SpaceFillingCurve')
+}
+SCENARIO_PARAMETERS = ('player_count', 'server_count', 'viewable_players', 'server_capacity', 'forward_weight',
+                       'map_size_x', 'map_size_y')
+RESULT_COLUMNS = (SCENARIO_KEY, METHOD, *SCENARIO_PARAMETERS, SEED, SETUP_TIME, TOTAL_TIME_ELAPSED, TOTAL_FWDS,
+                  MAX_LOAD_COLUMN, MEAN_LOAD, MIN_PLAYER_COUNT, MAX_PLAYER_COUNT, INVALID, *PHASE_COLUMNS,
+                  PEAK_RSS_BYTES)
+DEFAULT_METHOD_OPTIONS = {FOCUS_METHOD: {'number_of_tries': 10}}
+
+
+def get_method_class(method):
+    """Returns the Method subclass registered under a name, importing only that method"""
+    if method not in METHOD_CLASSES:
+        raise ValueError(f"Unknown method '{method}', expected one of {list(METHOD_CLASSES)}")
+    module_name, class_name = METHOD_CLASSES[method]
+    return getattr(import_module(module_name), class_name)
+
+
+def scenario_key(scenario):
+    """Identifies a scenario in the checkpoint file, its method options serialized canonically so runs with other
+    options never resume from each other"""
+    options = json.dumps(scenario[METHOD_OPTIONS], sort_keys=True, separators=(',', ':'))
+    return "_".join([*(f"{scenario[name]}" for name in (METHOD, *SCENARIO_PARAMETERS, SEED)), options])
+
+
+def generate_scenarios(methods, player_counts, server_counts, viewable_players, server_capacities, forward_weights,
+                       map_size_x=1000, map_size_y=1000, repetitions=1, base_seed=42, method_options=None):
+    """Returns every combination of the parameter grids, repeated with consecutive seeds. method_options maps a
+    method name to the keyword arguments of its constructor, on top of DEFAULT_METHOD_OPTIONS"""
+    all_options = {**DEFAULT_METHOD_OPTIONS, **(method_options or {})}
+    scenarios = []
+    for values in product(methods, player_counts, server_counts, viewable_players, server_capacities,
+                          forward_weights, range(repetitions)):
+        method, player_count, server_count, viewable, capacity, forward_weight, repetition = values
+        scenario = {METHOD: method, 'player_count': player_count, 'server_count': server_count,
+                    'viewable_players': viewable, 'server_capacity': capacity, 'forward_weight': forward_weight,
+                    'map_size_x': map_size_x, 'map_size_y': map_size_y, SEED: base_seed + repetition,
+                    METHOD_OPTIONS: dict(all_options.get(method, {}))}
+        scenario[SCENARIO_KEY] = scenario_key(scenario)
+        scenarios.append(scenario)
+    return scenarios
+
+
+def run_scenario(scenario, scenario_cache_dir=None):
+    """Builds and runs the method of a scenario with its output silenced, returning one results row. With a
+    scenario cache the players and neighbors are loaded from (or saved to) the disk cache shared by the workers"""
+    options = dict(scenario[METHOD_OPTIONS])
+    method_class = get_method_class(scenario[METHOD])
+    with contextlib.redirect_stdout(io.StringIO()), silenced_logging():
+        start = perf_counter()
+        seed(scenario[SEED])
+        if scenario_cache_dir is None:
+            np.random.seed(scenario[SEED])
+        else:
+            options['scenario'] = Scenario.load_or_build(scenario['player_count'], scenario['map_size_x'],
+                                                         scenario['map_size_y'], scenario['viewable_players'],
+                                                         scenario[SEED], scenario_cache_dir)
+            # same random draws as generating the players in place
+            np.random.set_state(options['scenario'].random_state)
+        method = method_class(**{name: scenario[name] for name in SCENARIO_PARAMETERS}, **options)
+        setup_time = perf_counter() - start
+        method.allocate_players()
+        evaluation = method.evaluate_allocation()
+    phases = method.data_output[PROFILE]['phases']
+    return {
+        **{column: scenario[column] for column in (SCENARIO_KEY, METHOD, *SCENARIO_PARAMETERS, SEED)},
+        SETUP_TIME: setup_time,
+        TOTAL_TIME_ELAPSED: method.data_output[TOTAL_TIME_ELAPSED],
+        TOTAL_FWDS: evaluation[TOTAL_FWDS],
+        MAX_LOAD_COLUMN: max(evaluation[LOAD]),
+        MEAN_LOAD: float(np.mean(evaluation[LOAD])),
+        MIN_PLAYER_COUNT: min(evaluation[PLAYER_COUNT]),
+        MAX_PLAYER_COUNT: max(evaluation[PLAYER_COUNT]),
+        INVALID: evaluation[INVALID],
+        **{column: phases[name]['seconds'] for name, column in zip(PHASES, PHASE_COLUMNS)},
+        PEAK_RSS_BYTES: method.data_output[PROFILE][PEAK_RSS_BYTES]
+    }
+
+
+def completed_scenarios(checkpoint_path):
+    """Returns the keys of the scenarios already written to a checkpoint file"""
+    if not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) == 0:
+        return set()
+    with open(checkpoint_path, newline='') as checkpoint:
+        reader = csv.DictReader(checkpoint)
+        if tuple(reader.fieldnames or ()) != RESULT_COLUMNS:
+            raise ValueError(f"The checkpoint {checkpoint_path} has other columns than {RESULT_COLUMNS}, "
+                             f"resume it with the version that wrote it or use another results path")
+        return {row[SCENARIO_KEY] for row in reader}
+
+
+def run_sweep(scenarios, results_path=None, number_of_workers=None, scenario_cache_dir=None, verbose=False):
+    """Runs the scenarios on a process pool, appending each result to a CSV checkpoint as soon as it finishes so an
+    interrupted sweep resumes where it stopped. Returns the results table as a DataFrame, also written as Parquet
+    when results_path ends in .parquet (the CSV checkpoint is kept next to it). With a scenario_cache_dir, scenarios
+    differing only by method, servers or costs share their players and neighbors through the disk cache"""
+    import pandas as pd
+
+    results_path = str(results_path or get_output_path("sweeps", "sweep_results.csv"))
+    checkpoint_path = os.path.splitext(results_path)[0] + ".csv"
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    done = completed_scenarios(checkpoint_path)
+    pending = [scenario for scenario in scenarios if scenario[SCENARIO_KEY] not in done]
+    if verbose:
+        print(f"{len(scenarios) - len(pending)} scenarios already done, running {len(pending)}")
+    write_header = not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) == 0
+    with open(checkpoint_path, 'a', newline='') as checkpoint:
+        writer = csv.DictWriter(checkpoint, fieldnames=RESULT_COLUMNS)
+        if write_header:
+            writer.writeheader()
+        with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+            futures = {executor.submit(run_scenario, scenario, scenario_cache_dir): scenario
+                       for scenario in pending}
+            for future in as_completed(futures):
+                row = future.result()
+                writer.writerow(row)
+                checkpoint.flush()
+                if verbose:
+                    print(f"{row[SCENARIO_KEY]}: {row[TOTAL_FWDS]} forwards in {row[TOTAL_TIME_ELAPSED]} seconds")
+    keys = {scenario[SCENARIO_KEY] for scenario in scenarios}
+    results = pd.read_csv(checkpoint_path)
+    results = results[results[SCENARIO_KEY].isin(keys)].reset_index(drop=True)
+    if results_path.endswith(".parquet"):
+        results.to_parquet(results_path, index=False)
+    return results